@@ -0,0 +1,278 @@
+"""
+Benchmarks for world generation, simulation and plotting.
+
+    python benchmarks.py --out bench.json
+    python benchmarks.py --quick --compare bench.json
+
+Every case starts from a fixed seed, so two runs do exactly the same work
+and their timings can be compared. Each case is timed `--repeat` times
+(keeping the best) with setup excluded, then run once more under
+tracemalloc for its peak memory. Results are written as JSON, and with
+--compare they are matched by name against an earlier results file.
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+import lingnetsim as lns
+from community import Community
+from lowbackmerger import GenerationalCommunity
+
+SEED = 1
+
+GEN_SIZES = [50, 100, 200, 500]
+GEN_DENSITIES = [4, 8, 16]
+WEIGHTINGS = [lns.neighbor_weighted_update,
+              lns.neighbor_size_weighted_update,
+              lns.neighbor_size_dist_weighted_update]
+LEARNINGS = [lns.copy_input, lns.clamp]
+COMMCLASSES = [Community, GenerationalCommunity]
+BACKENDS = ["object", "array"]
+
+
+class Case:
+    """
+    A named benchmark. setup() builds fresh inputs and is not timed;
+    run(inputs) does the measured work and returns the units of work done,
+    e.g. {'edges': ...}, from which rates per second are reported.
+    """
+
+    def __init__(self, name, params, setup, run):
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.run = run
+
+
+def case_name(kind, params):
+    args = ",".join(f"{k}={v}" for k, v in params.items())
+    return f"{kind}[{args}]"
+
+
+def count_edges(world):
+    return sum(len(comm.neighbors) for comm in world) // 2
+
+
+def gen_world_cases(sizes, densities):
+    cases = []
+    for size, density in itertools.product(sizes, densities):
+        def run(_, size=size, density=density):
+            world = lns.gen_world(size=size, density=density, seed=SEED)
+            return {'communities': len(world), 'edges': count_edges(world)}
+        params = {'size': size, 'density': density}
+        cases.append(Case(case_name("gen_world", params), params,
+                          lambda: None, run))
+    return cases
+
+
+def run_sim_cases(size, rounds, backends):
+    cases = []
+    for commclass, weighting, learning, randomize, backend in \
+            itertools.product(COMMCLASSES, WEIGHTINGS, LEARNINGS,
+                              [False, True], backends):
+        def setup(commclass=commclass):
+            world = lns.gen_world(size=size, density=4, seed=SEED,
+                                  commclass=commclass)
+            lns.init_sim(world, method=lns.single_locus_unchanging_city)
+            random.seed(SEED)
+            return world
+
+        def run(world, weighting=weighting, learning=learning,
+                randomize=randomize, backend=backend):
+            lns.run_sim(world, rounds, weighting=weighting,
+                        learning=learning, randomize=randomize,
+                        backend=backend)
+            return {'community_rounds': len(world) * rounds,
+                    'edge_rounds': count_edges(world) * rounds}
+
+        params = {'size': size, 'rounds': rounds,
+                  'commclass': commclass.__name__,
+                  'weighting': weighting.__name__,
+                  'learning': learning.__name__,
+                  'randomize': randomize, 'backend': backend}
+        cases.append(Case(case_name("run_sim", params), params, setup, run))
+    return cases
+
+
+def frontier_cases(size, rounds, tols):
+    """
+    A single locus spreading from a city with copy_input, the case the
+    active frontier is meant for, as a full sweep (tol=None) and with
+    frontier scheduling at each tolerance.
+    """
+    cases = []
+    for weighting, tol in itertools.product(WEIGHTINGS, [None] + tols):
+        def setup():
+            world = lns.gen_world(size=size, density=4, seed=SEED)
+            lns.init_sim(world, method=lns.single_locus_unchanging_city)
+            return world
+
+        def run(world, weighting=weighting, tol=tol):
+            lns.run_sim(world, rounds, weighting=weighting,
+                        learning=lns.copy_input, frontier_tol=tol)
+            return {'community_rounds': len(world) * rounds}
+
+        params = {'size': size, 'rounds': rounds,
+                  'weighting': weighting.__name__, 'tol': tol}
+        cases.append(Case(case_name("frontier", params), params, setup, run))
+    return cases
+
+
+def plot_world_cases(sizes):
+    cases = []
+    for size, color in itertools.product(sizes, ["default", "values"]):
+        def setup(size=size):
+            world = lns.gen_world(size=size, density=4, seed=SEED)
+            lns.init_sim(world, method=lns.single_locus_random_free)
+            plt.figure()
+            return world
+
+        def run(world, color=color):
+            lns.plot_world(world, color=color)
+            plt.gcf().canvas.draw()
+            plt.close()
+            return {'communities': len(world), 'edges': count_edges(world)}
+
+        params = {'size': size, 'color': color}
+        cases.append(Case(case_name("plot_world", params), params,
+                          setup, run))
+    return cases
+
+
+def measure(case, repeat=3, memory=True):
+    """Time a case and return its result record."""
+    best = None
+    for i in range(repeat):
+        inputs = case.setup()
+        start = time.perf_counter()
+        units = case.run(inputs)
+        wall = time.perf_counter() - start
+        best = wall if best is None else min(best, wall)
+
+    result = {
+        'name': case.name,
+        'params': case.params,
+        'wall': best,
+        'units': units,
+        'rates': {f"{unit}_per_sec": n / best for unit, n in units.items()},
+    }
+    if memory:
+        inputs = case.setup()
+        tracemalloc.start()
+        case.run(inputs)
+        result['peak_mem'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def environment():
+    return {
+        'date': datetime.now().isoformat(timespec="seconds"),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'argv': sys.argv[1:],
+    }
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Print each result's speedup over the same case in `baseline`, and
+    return the names of cases that got slower by more than `tolerance`.
+    """
+    old = {r['name']: r for r in baseline['results']}
+    slower = []
+    print(f"{'case':<70} {'base':>9} {'now':>9} {'speedup':>8}")
+    for result in results:
+        if result['name'] not in old:
+            continue
+        base = old[result['name']]['wall']
+        speedup = base / result['wall']
+        flag = ""
+        if result['wall'] > base * (1 + tolerance):
+            slower.append(result['name'])
+            flag = "  SLOWER"
+        print(f"{result['name']:<70} {base:9.4f} {result['wall']:9.4f} "
+              f"{speedup:7.2f}x{flag}")
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--out", default="benchmarks.json",
+                        help="where to write the results")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="slowdown allowed before a case counts as slower")
+    parser.add_argument("--only",
+                        default="gen_world,run_sim,frontier,plot_world",
+                        help="comma-separated groups of cases to run")
+    parser.add_argument("--filter", default="",
+                        help="only run cases whose name contains this")
+    parser.add_argument("--backend", default=",".join(BACKENDS),
+                        help="comma-separated run_sim backends")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="skip the tracemalloc pass")
+    parser.add_argument("--quick", action="store_true",
+                        help="small sizes only, for a fast check")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    groups = args.only.split(",")
+    cases = []
+    if "gen_world" in groups:
+        if args.quick:
+            cases += gen_world_cases([50, 100], [4, 8])
+        else:
+            cases += gen_world_cases(GEN_SIZES, GEN_DENSITIES)
+    if "run_sim" in groups:
+        size, rounds = (50, 20) if args.quick else (100, 50)
+        cases += run_sim_cases(size, rounds, args.backend.split(","))
+    if "frontier" in groups:
+        size, rounds = (200, 20) if args.quick else (500, 50)
+        cases += frontier_cases(size, rounds, [1e-2, 1e-4])
+    if "plot_world" in groups:
+        cases += plot_world_cases([50] if args.quick else [50, 100])
+    cases = [case for case in cases if args.filter in case.name]
+
+    results = []
+    for i, case in enumerate(cases):
+        result = measure(case, repeat=args.repeat, memory=not args.no_memory)
+        rates = ", ".join(f"{n:,.0f} {unit.replace('_', ' ')}"
+                          for unit, n in result['rates'].items())
+        print(f"[{i + 1}/{len(cases)}] {case.name}: "
+              f"{result['wall']:.4f}s ({rates})", flush=True)
+        results.append(result)
+
+    with open(args.out, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2)
+    print(f"Wrote {len(results)} results to '{args.out}'.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        if slower:
+            print(f"{len(slower)} cases slower than the baseline.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Saving and restoring the complete state of a simulation.
+
+A checkpoint is a single compressed .npz file holding the world topology,
+the per-community state, the history, the state of the `random` module and
+that of the run's NumPy Generator, if it has one, so that a run resumed
+from it continues bit for bit. A history streamed to disk by a DiskHistory
+is not copied: the checkpoint records its file and length, and the
+resumed run streams on into the same file.
+"""
+
+import importlib
+import json
+import os
+import random
+
+import numpy as np
+
+from history import DiskHistory, History, get_history
+from lowbackmerger import NUM_GENERATIONS
+from world import World
+
+
+def _class_path(cls):
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _load_class(path):
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def world_to_arrays(world):
+    """Topology of the world as a dict of arrays (see world_from_arrays)."""
+    if isinstance(world, World):
+        return {
+            'commclass': np.array(_class_path(World)),
+            'x': world.x.copy(),
+            'y': world.y.copy(),
+            'type': np.array(world.types),
+            'indptr': world.indptr.copy(),
+            'indices': world.indices.astype(np.int64),
+            'weights': world.weights.copy(),
+        }
+    index = {comm: i for i, comm in enumerate(world)}
+    indptr = [0]
+    indices = []
+    weights = []
+    for comm in world:
+        for other, wt in comm.neighbors.items():
+            indices.append(index[other])
+            weights.append(wt)
+        indptr.append(len(indices))
+    return {
+        'commclass': np.array(_class_path(type(world[0]))),
+        'x': np.array([comm.x for comm in world]),
+        'y': np.array([comm.y for comm in world]),
+        'type': np.array([comm.type for comm in world]),
+        'indptr': np.array(indptr, dtype=np.int64),
+        'indices': np.array(indices, dtype=np.int64),
+        'weights': np.array(weights, dtype=float),
+    }
+
+
+def world_from_arrays(arrays, commclass=None):
+    """
+    Rebuild a world from world_to_arrays output. Neighbor dicts are restored
+    with their original order and weights.
+    """
+    if commclass is None:
+        commclass = _load_class(str(arrays['commclass']))
+    if commclass is World:
+        return World.from_arrays(arrays['x'], arrays['y'],
+                                 arrays['type'].tolist(), arrays['indptr'],
+                                 arrays['indices'], arrays['weights'])
+    world = [commclass(x, y, str(commtype)) for x, y, commtype
+             in zip(arrays['x'].tolist(), arrays['y'].tolist(),
+                    arrays['type'])]
+    indptr = arrays['indptr'].tolist()
+    indices = arrays['indices'].tolist()
+    weights = arrays['weights'].tolist()
+    for i, comm in enumerate(world):
+        comm.neighbors = {world[j]: wt for j, wt
+                          in zip(indices[indptr[i]:indptr[i+1]],
+                                 weights[indptr[i]:indptr[i+1]])}
+    return world
+
+
+def random_state_to_arrays():
+    version, state, gauss_next = random.getstate()
+    return {
+        'random_version': np.array(version),
+        'random_state': np.array(state, dtype=np.uint64),
+        'random_gauss': np.array(np.nan if gauss_next is None
+                                 else gauss_next),
+    }
+
+
+def random_state_from_arrays(arrays):
+    gauss_next = float(arrays['random_gauss'])
+    random.setstate((int(arrays['random_version']),
+                     tuple(arrays['random_state'].tolist()),
+                     None if np.isnan(gauss_next) else gauss_next))
+
+
+def _rows(a):
+    """Per-community values: floats, or arrays for feature vectors."""
+    return a.tolist() if a.ndim == 1 else list(np.asarray(a, dtype=float))
+
+
+def save_checkpoint(world, path, rng=None, **meta):
+    """
+    Save the complete simulation state to `path`, including the state of
+    the Generator `rng` the run draws from, if any. Keyword arguments are
+    stored as JSON metadata and returned again by load_checkpoint.
+    """
+    arrays = world_to_arrays(world)
+    arrays.update(random_state_to_arrays())
+    if rng is not None:
+        arrays['rng_state'] = np.array(json.dumps(rng.bit_generator.state))
+    arrays['rate_of_change'] = np.array(
+        [comm.rate_of_change for comm in world], dtype=float)
+    if hasattr(world[0], 'adult_vals'):
+        arrays['children_val'] = np.array(
+            [comm.children_val for comm in world], dtype=float)
+        arrays['adult_vals'] = np.array(
+            [comm.adult_vals[-NUM_GENERATIONS:] for comm in world],
+            dtype=float)
+    else:
+        arrays['val'] = np.array([comm.val for comm in world], dtype=float)
+
+    store = get_history(world)
+    if isinstance(store, DiskHistory):
+        store.flush()
+        arrays['hist_path'] = np.array(os.path.abspath(store.path))
+        arrays['hist_rows'] = np.array(len(store))
+        arrays['hist_chunk'] = np.array(len(store.data))
+    elif store is not None:
+        arrays['hist'] = np.asarray(store.array())
+    if store is not None:
+        arrays['hist_store'] = np.array(True)
+        if len(store):
+            arrays['hist_last'] = np.array(store.last, dtype=float)
+    else:
+        arrays['hist'] = np.array([comm.hist for comm in world],
+                                  dtype=float).T
+        arrays['hist_store'] = np.array(False)
+
+    arrays['meta'] = np.array(json.dumps(meta))
+    with open(path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def load_checkpoint(path, restore_random=True):
+    """
+    Load a checkpoint saved by save_checkpoint and return the world and the
+    metadata it was saved with. The state of the `random` module is
+    restored as well unless restore_random is False. If the run drew from a
+    Generator, its state is returned as meta['rng_state'], to be passed on
+    as run_sim(rng=...). A DiskHistory is reopened on its file, cut back to
+    the rounds recorded when the checkpoint was saved.
+    """
+    with np.load(path) as arrays:
+        world = world_from_arrays(arrays)
+        for comm, rate in zip(world, _rows(arrays['rate_of_change'])):
+            comm.rate_of_change = rate
+        if 'adult_vals' in arrays:
+            for comm, children_val, adult_vals in zip(
+                    world, arrays['children_val'].tolist(),
+                    arrays['adult_vals'].tolist()):
+                comm.children_val = children_val
+                comm.adult_vals = adult_vals
+        else:
+            for comm, val in zip(world, _rows(arrays['val'])):
+                comm.val = val
+
+        # feature vectors add a last axis to the state and the history
+        if 'hist_path' in arrays:
+            store = DiskHistory.reopen(str(arrays['hist_path']),
+                                       int(arrays['hist_rows']),
+                                       chunk=int(arrays['hist_chunk']))
+            store.attach(world)
+        elif bool(arrays['hist_store']):
+            hist = arrays['hist']
+            store = History(len(world), len(hist), dtype=hist.dtype,
+                            nfeatures=hist.shape[2] if hist.ndim == 3
+                            else None)
+            store.attach(world)
+            for row in hist:
+                store.append_row(row)
+        else:
+            hist = arrays['hist']
+            for comm, column in zip(world, hist.T):
+                comm.hist = column.tolist() if hist.ndim == 2 else list(column)
+        if 'hist_last' in arrays:
+            store.last = _rows(arrays['hist_last'])
+
+        if restore_random:
+            random_state_from_arrays(arrays)
+        meta = json.loads(str(arrays['meta']))
+        if 'rng_state' in arrays:
+            meta['rng_state'] = json.loads(str(arrays['rng_state']))
+    return world, meta
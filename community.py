@@ -14,6 +14,33 @@ DIST_THRESHOLDS[('village', 'town')] = DIST_THRESHOLDS[('town', 'village')]
 DIST_THRESHOLDS[('village', 'city')] = DIST_THRESHOLDS[('city', 'village')]
 DIST_THRESHOLDS[('town', 'city')] = DIST_THRESHOLDS[('city', 'town')]
 
+# bumped whenever add_neighbor changes the graph, so that cached lists of
+# second-degree neighbors can tell they are out of date
+_graph_version = 0
+
+
+def graph_changed():
+    global _graph_version
+    _graph_version += 1
+
+
+def cached_ind_neighbors(comm):
+    """
+    The neighbors of comm's neighbors that are neither comm itself nor its
+    neighbors, each once, in order of first appearance. The list is cached
+    on comm until the graph changes through add_neighbor.
+    """
+    cache = comm._ind_neighbors
+    if cache is None or cache[0] != _graph_version:
+        neighbors = comm.neighbors
+        found = {}
+        for n in neighbors:
+            for nn in n.neighbors:
+                if nn not in neighbors and nn is not comm:
+                    found[nn] = None
+        cache = comm._ind_neighbors = (_graph_version, list(found))
+    return cache[1]
+
 
 class Community:
     def __init__(self, x, y, commtype="village"):
@@ -24,6 +51,7 @@ class Community:
         self.rate_of_change = 1.0
         self.hist = []
         self.neighbors = {}
+        self._ind_neighbors = None
 
     def to_dict(self, t="now"):
         if t == "now":
@@ -43,14 +71,14 @@ class Community:
     def update(self, newval):
         self.val = self.val + self.rate_of_change * (newval - self.val)
 
-    def jitter(self, amt):
-        self.val = util.random_jitter(self.val, amt)
+    def jitter(self, amt, noise=None):
+        self.val = util.random_jitter(self.val, amt, noise)
 
-    def add_neighbor(self, other, dist):
-        threshold = DIST_THRESHOLDS[(self.type, other.type)]
+    def add_neighbor(self, other, dist, thresholds=DIST_THRESHOLDS):
+        threshold = thresholds[(self.type, other.type)]
         self.neighbors[other] = (threshold - dist) / threshold
+        graph_changed()
 
     @property
     def ind_neighbors(self):
-        return [nn for n in self.neighbors for nn in n.neighbors
-                if nn not in self.neighbors]
+        return cached_ind_neighbors(self)
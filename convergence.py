@@ -0,0 +1,51 @@
+"""
+Stopping criteria for simulations that have reached a steady state.
+"""
+
+import numpy as np
+
+
+class Convergence:
+    """
+    Decides when a run has converged, from the values of all communities
+    before and after each round.
+
+    criterion is one of:
+      "max"   -- largest change of any community is at most tol
+      "l2"    -- L2 norm of the changes is at most tol
+      "flips" -- no community crosses `cutoff` (as with clamp)
+    and must hold for `patience` consecutive rounds.
+    """
+
+    def __init__(self, tol=1e-6, criterion="max", patience=1, cutoff=0.5):
+        if criterion not in ("max", "l2", "flips"):
+            raise ValueError(f"No such convergence criterion: {criterion}")
+        self.tol = tol
+        self.criterion = criterion
+        self.patience = patience
+        self.cutoff = cutoff
+        self.quiet = 0
+
+    def reset(self):
+        self.quiet = 0
+
+    def change(self, old, new):
+        old = np.asarray(old, dtype=float)
+        new = np.asarray(new, dtype=float)
+        if self.criterion == "max":
+            return float(np.abs(new - old).max(initial=0.0))
+        elif self.criterion == "l2":
+            return float(np.linalg.norm(new - old))
+        else:
+            return int(np.count_nonzero((old > self.cutoff)
+                                        != (new > self.cutoff)))
+
+    def check(self, old, new):
+        """Record one round and return whether the run has converged."""
+        change = self.change(old, new)
+        if self.criterion == "flips":
+            steady = change == 0
+        else:
+            steady = change <= self.tol
+        self.quiet = self.quiet + 1 if steady else 0
+        return self.quiet >= self.patience
@@ -0,0 +1,142 @@
+"""
+Rendering a stored run to image frames or an animation.
+
+The world geometry is computed once and handed to every worker process,
+which builds a single figure with a WorldView and then only swaps in the
+values of each round it renders. FrameWriter does the same for individual
+figures in the background, so that saving overlaps with simulating.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from history import default_feature, get_history
+from plotting import WorldGeometry, WorldView, world_values
+
+logger = logging.getLogger(__name__)
+
+_view = None
+
+
+def _init_worker(geometry, color, figsize, dpi):
+    global _view
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    _view = WorldView(geometry, color=color, ax=ax)
+    fig.tight_layout()
+
+
+def _render(frames):
+    """Render (values, path) pairs with this worker's view."""
+    for values, path in frames:
+        _view.set_values(values)
+        _view.ax.figure.savefig(path)
+    return len(frames)
+
+
+def export_frames(world, outdir, every=1, start=0, stop=None, color="values",
+                  fmt="png", workers=None, batch=64, figsize=(6.4, 4.8),
+                  dpi=100, feature=None):
+    """
+    Render every `every`-th stored round of the world's history to
+    `outdir`/frame-<round>.<fmt>, spread over `workers` processes in
+    batches of at most `batch` frames. Returns the frame paths in round
+    order. For feature vectors, `feature` picks the feature (default 0).
+    """
+    os.makedirs(outdir, exist_ok=True)
+    stop = len(world[0].hist) if stop is None else stop
+    rounds = list(range(start, stop, every))
+    paths = [f"{outdir}/frame-{t:05d}.{fmt}" for t in rounds]
+    geometry = WorldGeometry(world)
+    workers = workers or os.cpu_count()
+    feature = default_feature(world, feature)
+    store = get_history(world)
+    if store is None:
+        hist = np.array([comm.hist for comm in world],
+                        dtype=float).swapaxes(0, 1)
+        if feature is not None:
+            hist = hist[..., feature]
+    elif feature is None:
+        hist = store.array()
+    else:
+        hist = store.feature(feature)
+
+    logger.info(f"Rendering {len(rounds)} frames to '{outdir}'.")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(geometry, color, figsize, dpi)) as pool:
+        # contiguous batches, paged in from the history one at a time
+        size = max(1, min(batch, -(-len(rounds) // workers)))
+        futures = []
+        for i in range(0, len(rounds), size):
+            chunk = rounds[i:i + size]
+            vals = np.asarray(hist[chunk[0]:chunk[-1] + 1])
+            frames = [(vals[t - chunk[0]], path)
+                      for t, path in zip(chunk, paths[i:i + size])]
+            futures.append(pool.submit(_render, frames))
+        for future in futures:
+            future.result()
+    return paths
+
+
+def export_animation(world, path, every=1, start=0, stop=None,
+                     color="values", fps=10, figsize=(6.4, 4.8), dpi=100,
+                     feature=None):
+    """
+    Write every `every`-th stored round of the world's history to an
+    animation file. The writer is chosen from the extension (.gif uses
+    pillow, anything else ffmpeg). For feature vectors, `feature` picks
+    the feature (default 0).
+    """
+    from matplotlib import animation
+
+    feature = default_feature(world, feature)
+    stop = len(world[0].hist) if stop is None else stop
+    rounds = range(start, stop, every)
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    view = WorldView(WorldGeometry(world), color=color, ax=fig.add_subplot())
+    fig.tight_layout()
+
+    def draw(t):
+        view.set_values(world_values(world, t, feature))
+        return view.nodes,
+
+    writer = "pillow" if path.endswith(".gif") else "ffmpeg"
+    logger.info(f"Writing {len(rounds)} frames to '{path}'.")
+    anim = animation.FuncAnimation(fig, draw, frames=rounds, blit=True)
+    anim.save(path, writer=writer, fps=fps)
+
+
+class FrameWriter:
+    """
+    Saves world figures in background processes. submit() takes a snapshot
+    of the values and returns at once, so the caller can keep simulating.
+    """
+
+    def __init__(self, world, color="values", workers=1, figsize=(6.4, 4.8),
+                 dpi=100):
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=(WorldGeometry(world), color, figsize, dpi))
+        self.futures = []
+
+    def submit(self, values, path):
+        values = np.array(values, dtype=float)
+        self.futures.append(self.pool.submit(_render, [(values, path)]))
+
+    def close(self):
+        for future in self.futures:
+            future.result()
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,394 @@
+"""
+Preallocated, columnar store for simulation history.
+
+A History holds one (rounds x communities) array for a whole world, or a
+(rounds x communities x features) array when communities carry a vector of
+feature values instead of a single value. Each
+community's `hist` is replaced by a HistoryView onto its column, which
+behaves like the list it replaces (append, len, indexing, iteration) so the
+weighting functions and plots keep working unchanged. A DiskHistory streams
+the same rows to a .npy file instead of keeping them in memory.
+
+The store's dtype only sets the precision of what is recorded: the last
+value appended for each community is also kept at full precision, and that
+is what hist[-1] returns, so a float16 or float32 store leaves the
+simulation itself unchanged.
+"""
+
+import numpy as np
+
+
+class History:
+    def __init__(self, ncomms, rounds=0, dtype="float64", nfeatures=None):
+        self.dtype = np.dtype(dtype)
+        self.nfeatures = nfeatures
+        self.data = np.empty((max(rounds, 1),) + _row_shape(ncomms, nfeatures),
+                             dtype=self.dtype)
+        self.counts = [0] * ncomms
+        self.last = [None] * ncomms
+
+    def __len__(self):
+        """Number of rounds recorded for every community."""
+        return min(self.counts, default=0)
+
+    @property
+    def ncomms(self):
+        return len(self.counts)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def reserve(self, rounds):
+        """Make room for `rounds` more rounds without reallocating."""
+        needed = max(self.counts, default=0) + rounds
+        if needed > len(self.data):
+            capacity = max(needed, 2 * len(self.data))
+            data = np.empty((capacity,) + self.data.shape[1:],
+                            dtype=self.dtype)
+            data[:len(self.data)] = self.data
+            self.data = data
+
+    def append(self, col, val):
+        t = self.counts[col]
+        if t == len(self.data):
+            self.reserve(1)
+        self.data[t, col] = val
+        self.counts[col] = t + 1
+        self.last[col] = self._full(val)
+
+    def append_row(self, vals):
+        t = len(self)
+        if max(self.counts, default=0) != t:
+            raise ValueError("Cannot append a row to a ragged history.")
+        if t == len(self.data):
+            self.reserve(1)
+        self.data[t] = vals
+        self.counts = [t + 1] * self.ncomms
+        self.last = self._full_row(vals)
+
+    def _full(self, val):
+        if self.nfeatures is None:
+            return float(val)
+        return np.array(val, dtype=float)
+
+    def _full_row(self, vals):
+        vals = np.array(vals, dtype=float)
+        return vals.tolist() if self.nfeatures is None else list(vals)
+
+    def get(self, t, col):
+        return self.data[t, col]
+
+    def flush(self):
+        pass
+
+    def round(self, t):
+        """Values of all communities at round t (a view)."""
+        if t < 0:
+            t += len(self)
+        return self.data[t]
+
+    def column(self, col):
+        """All recorded values of one community (a view)."""
+        return self.data[:self.counts[col], col]
+
+    def feature(self, f, start=None, stop=None):
+        """The (rounds x communities) block of recorded rounds of feature f."""
+        return self.array(start, stop)[..., f]
+
+    def array(self, start=None, stop=None):
+        """The (rounds x communities) block of recorded rounds (a view)."""
+        return self.data[:len(self)][start:stop]
+
+    def attach(self, world):
+        for col, comm in enumerate(world):
+            comm.hist = HistoryView(self, col)
+
+    def adopt(self, world):
+        """Copy the world's existing history into the store and attach it."""
+        self.reserve(max((len(comm.hist) for comm in world), default=0))
+        for col, comm in enumerate(world):
+            for val in comm.hist:
+                self.append(col, val)
+        self.attach(world)
+
+
+class HistoryView:
+    __slots__ = ("store", "col")
+
+    def __init__(self, store, col):
+        self.store = store
+        self.col = col
+
+    def __len__(self):
+        return self.store.counts[self.col]
+
+    def __getitem__(self, t):
+        # the last value is the one the weighting functions read, every
+        # round, so it is returned first and at full precision
+        if t == -1:
+            last = self.store.last[self.col]
+            if last is not None:
+                return last if self.store.nfeatures is None else last.copy()
+        if isinstance(t, slice):
+            return self.store.column(self.col)[t]
+        n = len(self)
+        if t < 0:
+            t += n
+        if not 0 <= t < n:
+            raise IndexError("history index out of range")
+        if t == n - 1 and self.store.last[self.col] is not None:
+            return self._last()
+        if self.store.nfeatures is not None:
+            return self.store.get(t, self.col).copy()
+        return float(self.store.get(t, self.col))
+
+    def _last(self):
+        last = self.store.last[self.col]
+        return last if self.store.nfeatures is None else last.copy()
+
+    def __iter__(self):
+        if self.store.nfeatures is not None:
+            return iter(self.store.column(self.col).copy())
+        return iter(self.store.column(self.col).tolist())
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.store.column(self.col), dtype=dtype)
+
+    def __repr__(self):
+        return f"HistoryView({self.store.column(self.col)!r})"
+
+    def append(self, val):
+        self.store.append(self.col, val)
+
+    def extend(self, vals):
+        for val in vals:
+            self.store.append(self.col, val)
+
+
+class DiskHistory(History):
+    """
+    History that streams rounds to a .npy file in chunks of `chunk` rounds,
+    so that only the current chunk is held in memory. Recorded rounds are
+    read back through a memory map, paging in only what is accessed.
+    """
+
+    HEADER_LEN = 128
+
+    def __init__(self, path, ncomms, dtype="float64", chunk=256,
+                 nfeatures=None):
+        self._setup(path, ncomms, dtype, chunk, nfeatures)
+        with open(path, 'wb') as f:
+            self._write_header(f)
+
+    def _setup(self, path, ncomms, dtype, chunk, nfeatures, rows=0):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.nfeatures = nfeatures
+        self.data = np.empty((chunk,) + _row_shape(ncomms, nfeatures),
+                             dtype=self.dtype)
+        self.counts = [rows] * ncomms
+        self.last = [None] * ncomms
+        self.flushed = rows
+        self._mmap = None
+
+    @classmethod
+    def reopen(cls, path, rows=None, chunk=256):
+        """
+        Continue the history in a file written by a DiskHistory after its
+        first `rows` rounds (all of them by default). Any later rounds are
+        cut off, as when resuming from a checkpoint saved at `rows`.
+        """
+        written = np.load(path, mmap_mode='r')
+        if written.offset != cls.HEADER_LEN:
+            raise ValueError(f"'{path}' was not written by a DiskHistory.")
+        rows = len(written) if rows is None else rows
+        if rows > len(written):
+            raise ValueError(f"'{path}' holds {len(written)} rounds, "
+                             f"not {rows}.")
+        self = cls.__new__(cls)
+        self._setup(path, written.shape[1], written.dtype, chunk,
+                    written.shape[2] if written.ndim == 3 else None, rows)
+        if rows:
+            self.last = self._full_row(written[rows - 1])
+        del written
+        with open(path, 'r+b') as f:
+            f.truncate(self.HEADER_LEN + rows * self.data[0].nbytes)
+            self._write_header(f)
+        return self
+
+    def _write_header(self, f):
+        header = (f"{{'descr': {self.dtype.str!r}, 'fortran_order': False, "
+                  f"'shape': {(self.flushed,) + self.data.shape[1:]}, }}")
+        header = header.ljust(self.HEADER_LEN - 11) + "\n"
+        f.seek(0)
+        f.write(b"\x93NUMPY\x01\x00")
+        f.write((self.HEADER_LEN - 10).to_bytes(2, 'little'))
+        f.write(header.encode('latin1'))
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def reserve(self, rounds):
+        pass
+
+    def adopt(self, world):
+        """
+        Write the world's existing history to the file round by round, so
+        that any number of rounds fits through the one chunk, and attach.
+        """
+        lengths = {len(comm.hist) for comm in world}
+        if len(lengths) > 1:
+            raise ValueError("Cannot adopt a ragged history.")
+        for t in range(max(lengths, default=0)):
+            self.append_row([comm.hist[t] for comm in world])
+        self.attach(world)
+
+    def append(self, col, val):
+        t = self.counts[col] - self.flushed
+        if t == len(self.data):
+            self.flush()
+            t = self.counts[col] - self.flushed
+            if t == len(self.data):
+                raise ValueError("Cannot flush a ragged history.")
+        self.data[t, col] = val
+        self.counts[col] += 1
+        self.last[col] = self._full(val)
+
+    def append_row(self, vals):
+        t = len(self)
+        if max(self.counts, default=0) != t:
+            raise ValueError("Cannot append a row to a ragged history.")
+        if t - self.flushed == len(self.data):
+            self.flush()
+        self.data[t - self.flushed] = vals
+        self.counts = [t + 1] * self.ncomms
+        self.last = self._full_row(vals)
+
+    def flush(self):
+        """Write all complete rounds held in memory to disk."""
+        rows = len(self) - self.flushed
+        if rows == 0:
+            return
+        with open(self.path, 'r+b') as f:
+            f.seek(0, 2)
+            f.write(self.data[:rows].tobytes())
+            self.flushed += rows
+            self._write_header(f)
+        # columns that are already ahead keep their values for the next chunk
+        self.data[:len(self.data) - rows] = self.data[rows:]
+        self._mmap = None
+
+    def mmap(self):
+        """Memory map of all rounds flushed to disk so far."""
+        if self._mmap is None:
+            self._mmap = np.load(self.path, mmap_mode='r')
+        return self._mmap
+
+    def get(self, t, col):
+        if t >= self.flushed:
+            return self.data[t - self.flushed, col]
+        return self.mmap()[t, col]
+
+    def round(self, t):
+        if t < 0:
+            t += len(self)
+        if t >= self.flushed:
+            return self.data[t - self.flushed]
+        return self.mmap()[t]
+
+    def column(self, col):
+        return np.concatenate(
+            (self.mmap()[:, col],
+             self.data[:self.counts[col] - self.flushed, col]))
+
+    def array(self, start=None, stop=None):
+        start, stop, _ = slice(start, stop).indices(len(self))
+        if stop <= self.flushed:
+            return self.mmap()[start:stop]
+        if start >= self.flushed:
+            return self.data[start - self.flushed:stop - self.flushed]
+        return np.concatenate((self.mmap()[start:],
+                               self.data[:stop - self.flushed]))
+
+
+def open_history(path):
+    """Memory-map a history file written by DiskHistory."""
+    return np.load(path, mmap_mode='r')
+
+
+def _row_shape(ncomms, nfeatures):
+    return (ncomms,) if nfeatures is None else (ncomms, nfeatures)
+
+
+def world_features(world):
+    """Number of features the communities carry, or None for single values."""
+    if len(world) and np.ndim(world[0].val):
+        return len(world[0].val)
+    return None
+
+
+def default_feature(world, feature=None):
+    """The feature to show: `feature`, or 0 for feature vectors if None."""
+    if feature is None and world_features(world) is not None:
+        return 0
+    return feature
+
+
+def init_history(world, rounds=0, dtype="float64"):
+    """
+    Move the history of every community in the world into a new shared
+    store with room for `rounds` more rounds, and return the store.
+    """
+    store = History(len(world), rounds, dtype=dtype,
+                    nfeatures=world_features(world))
+    store.adopt(world)
+    store.reserve(rounds)
+    return store
+
+
+def get_history(world):
+    """Return the shared store backing the world's history, if any."""
+    if len(world) and isinstance(world[0].hist, HistoryView):
+        return world[0].hist.store
+    return None
+
+
+def world_values(world, t="now", feature=None):
+    """
+    Values of all communities at round t, or their current values. For
+    communities carrying feature vectors, `feature` picks the feature.
+    """
+    if t == "now":
+        vals = [comm.val for comm in world]
+    else:
+        store = get_history(world)
+        if store is not None:
+            vals = store.round(t)
+        else:
+            vals = [comm.hist[t] for comm in world]
+    if feature is not None:
+        return np.asarray(vals)[:, feature]
+    return vals
+
+
+def use_history(world, history, rounds=0):
+    """
+    Set up the store a simulation of `rounds` rounds should record into.
+
+    `history` may be None (keep whatever the world already uses), a History
+    instance, or a dtype name for a new store. Returns the store in use, or
+    None if the world still keeps plain lists.
+    """
+    store = get_history(world)
+    if history is None or history is store:
+        pass
+    elif isinstance(history, History):
+        history.adopt(world)
+        store = history
+    elif store is None or store.dtype != np.dtype(history):
+        store = init_history(world, rounds, dtype=history)
+    if store is not None:
+        store.reserve(rounds)
+    return store
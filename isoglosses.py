@@ -0,0 +1,38 @@
+"""
+Cross-feature statistics for worlds whose communities carry feature vectors.
+
+An isogloss of a feature runs along every link whose two communities use
+different variants of it (values on opposite sides of `cutoff`). Isoglosses
+of different features that run along the same links form a bundle, the
+classic sign of a dialect boundary.
+"""
+
+import numpy as np
+from scipy import sparse
+
+from history import world_values
+from vecsim import CompiledWorld
+
+
+def isogloss_bundling(world, t="now", cutoff=0.5):
+    """
+    Find the isoglosses of every feature at round t. Returns a dict of
+      'edges'       -- (links x 2) community indices i < j of every link
+      'crossings'   -- number of isoglosses crossing each link
+      'cooccurrence' -- (features x features) number of links crossed by
+                        both isoglosses; the diagonal is each isogloss's
+                        length in links
+    """
+    cw = CompiledWorld(world)
+    links = sparse.triu(cw.adjacency, k=1).tocoo()
+    i, j = links.row, links.col
+    variant = np.asarray(world_values(world, t), dtype=float) > cutoff
+    if variant.ndim == 1:
+        variant = variant[:, None]
+    differs = variant[i] != variant[j]
+    counts = differs.astype(np.int64)
+    return {
+        'edges': np.column_stack([i, j]),
+        'crossings': counts.sum(axis=1),
+        'cooccurrence': counts.T @ counts,
+    }
@@ -1,21 +1,33 @@
 import sys
 import random
-from math import sqrt
-import matplotlib.pyplot as plt
+import itertools
+from functools import partial
+import numpy as np
 
 import logging
 import os
+import types
 
 from community import *
-from plotting import *
-# import util
+from spatial import GridIndex, candidate_pairs
+from world import TYPES, TYPE_CODES
+from checkpoint import save_checkpoint, load_checkpoint
+import profiling
+from profiling import phase, count, write_metrics
+from history import (DiskHistory, get_history, use_history, world_features,
+                     world_values, default_feature)
+import util
+from lowbackmerger import NUM_GENERATIONS
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 
-def init_savedir(dirname):
+def init_savedir(dirname, profile=False, trace_memory=False):
+    """Create the output directory and log to it. With profile set, timing
+    metrics (and with trace_memory, the peak memory of each phase) are
+    recorded for write_metrics(dirname) to save at the end."""
     try:
         os.mkdir(dirname)
     except FileExistsError:
@@ -26,137 +38,308 @@ def init_savedir(dirname):
     filehandler.setLevel(logging.INFO)
     logger.addHandler(filehandler)
 
+    if profile:
+        profiling.enable(trace_memory=trace_memory)
+
+
+# plotting (and with it matplotlib) is only imported once a figure is asked
+# for, so that worlds can be generated and simulated without it; these names
+# are still available as attributes of this module
+PLOTTING_NAMES = ("plot_nodes", "plot_edges", "plot_world", "plot_val_by_comm",
+                  "plot_avg_val", "WorldGeometry", "WorldView", "TYPE_COLORS",
+                  "TYPE_SIZES", "CONNECTION_COLORS", "NODE_SCHEMES",
+                  "WORLD_SCHEMES")
+
+
+def __getattr__(name):
+    if name == "plt":
+        import matplotlib.pyplot as plt
+        return plt
+    if name in PLOTTING_NAMES:
+        import plotting
+        return getattr(plotting, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def save_figure(path):
+    import matplotlib.pyplot as plt
+
+    with phase("savefig"):
+        plt.savefig(path)
+
+
+def promote(world, from_type, to_type, a, b):
+    """
+    Promote communities of `from_type` to `to_type`, in order of decreasing
+    degree, if they have more than `b` neighbors of their own type beyond
+    `a` for every neighbor of the type they would become. Returns the
+    number promoted.
+    """
+    promoted = 0
+    for comm in sorted(world, reverse=True, key=lambda c: len(c.neighbors)):
+        if comm.type != from_type:
+            continue
+        n_from = len([n for n in comm.neighbors if n.type == from_type])
+        n_to = len([n for n in comm.neighbors if n.type == to_type])
+        if n_from - a * n_to > b:
+            comm.type = to_type
+            promoted += 1
+    return promoted
+
+
+def place_villages(size, density, rng=None):
+    """
+    Random (x, y) positions of the villages of a size x size map, from the
+    Generator `rng` or the global random module.
+    """
+    n = (size // 10) ** 2 * density
+    if rng is None:
+        return [(random.randrange(size), random.randrange(size))
+                for i in range(n)]
+    return rng.integers(size, size=(n, 2)).tolist()
+
 
 def gen_world(size=100, density=4, seed=None, commclass=Community,
-              savefig=False, savedir="figs"):
-    if seed is None:
-        seed = random.randrange(sys.maxsize)
-    random.seed(seed)
+              savefig=False, savedir="figs", cache=None, rng=None):
+    # villages are placed either with the global random module seeded with
+    # `seed`, or with draws from `rng` (a Generator or its seed), which
+    # leaves the global state alone
+    if seed is not None and rng is not None:
+        raise ValueError("Give gen_world a seed or an rng, not both.")
+    # only worlds with an explicit seed are reproducible, and figures of the
+    # generation phases need a real run
+    use_cache = cache is not None and seed is not None and not savefig
+    if use_cache:
+        key = cache.key(size, density, seed, commclass)
+        world = cache.load(key, commclass)
+        if world is not None:
+            return world
+
+    if rng is not None:
+        rng = util.make_rng(rng)
+    else:
+        if seed is None:
+            seed = random.randrange(sys.maxsize)
+        random.seed(seed)
 
     logger.info(f"Generating world with size={size}, density={density},"
                 f"random seed={seed}, commclass={commclass}")
 
     if savefig:
+        from plotting import plot_world
+
         filename = "worldgen_vals.txt"
         logger.info(f"Saving worldgen values to '{filename}'")
         with open(f"{savedir}/{filename}", 'w') as f:
             f.write(f"World generated with size={size}, density={density},"
                     f"random seed={seed}")
 
-    world = []
-    for i in range((size // 10) ** 2 * density):
-        x = random.randrange(size)
-        y = random.randrange(size)
-        world.append(commclass(x, y))
+    with phase("gen_world.placement"):
+        world = [commclass(x, y)
+                 for x, y in place_villages(size, density, rng)]
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen0-villages.pdf")
+        save_figure(savedir + "/network-gen0-villages.pdf")
 
     # form initial network
-    for i, comm1 in enumerate(world):
-        for comm2 in world[i+1:]:
-            dist = sqrt((comm1.x - comm2.x) ** 2 + (comm1.y - comm2.y) ** 2)
-            if dist < DIST_THRESHOLDS[('village', 'village')]:
-                comm1.add_neighbor(comm2, dist)
-                comm2.add_neighbor(comm1, dist)
+    with phase("gen_world.village_links"):
+        radius = DIST_THRESHOLDS[('village', 'village')]
+        links = 0
+        for i, j, dist in GridIndex(world, radius).pairs_within(radius):
+            comm1, comm2 = world[i], world[j]
+            comm1.add_neighbor(comm2, dist)
+            comm2.add_neighbor(comm1, dist)
+            links += 1
+        count("gen_world.village_links.edges", links)
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen1-connections.pdf")
+        save_figure(savedir + "/network-gen1-connections.pdf")
 
     # promote villages to towns
-    for comm in sorted(world, reverse=True, key=lambda c: len(c.neighbors)):
-        n_villages = len([n for n in comm.neighbors if n.type == "village"])
-        n_towns = len([n for n in comm.neighbors if n.type == "town"])
-        if n_villages - 5 * n_towns > 5:
-            comm.type = 'town'
+    with phase("gen_world.town_promotion"):
+        count("gen_world.town_promotion.towns",
+              promote(world, "village", "town", 5, 5))
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen2-towns.pdf")
+        save_figure(savedir + "/network-gen2-towns.pdf")
 
     # add medium distance connections
-    for i, comm1 in enumerate(world):
-        for comm2 in world[i+1:]:
-            dist = sqrt((comm1.x - comm2.x) ** 2 + (comm1.y - comm2.y) ** 2)
+    with phase("gen_world.town_links"):
+        radius = max(DIST_THRESHOLDS[("town", "village")],
+                     DIST_THRESHOLDS[("town", "town")])
+        towns = [i for i, comm in enumerate(world) if comm.type == "town"]
+        links = 0
+        for i, j, dist in GridIndex(world, radius).pairs_within(radius, towns):
+            comm1, comm2 = world[i], world[j]
             if comm1.type == "town" and comm2.type == "village" and \
                     dist < DIST_THRESHOLDS[("town", "village")]:
                 comm1.add_neighbor(comm2, dist)
                 comm2.add_neighbor(comm1, dist)
+                links += 1
             elif comm1.type == "town" and comm2.type == "town" and \
                     dist < DIST_THRESHOLDS[("town", "town")]:
                 comm1.add_neighbor(comm2, dist)
                 comm2.add_neighbor(comm1, dist)
+                links += 1
+        count("gen_world.town_links.edges", links)
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen3-town-conn.pdf")
+        save_figure(savedir + "/network-gen3-town-conn.pdf")
 
     # promote towns to cities
-    for comm in sorted(world, reverse=True, key=lambda c: len(c.neighbors)):
-        if comm.type != "town":
-            continue
-        n_villages = len([n for n in comm.neighbors if n.type == "village"])
-        n_towns = len([n for n in comm.neighbors if n.type == "town"])
-        n_cities = len([n for n in comm.neighbors if n.type == "city"])
-        if n_towns - 4 * n_cities > 4:
-            comm.type = 'city'
+    with phase("gen_world.city_promotion"):
+        count("gen_world.city_promotion.cities",
+              promote(world, "town", "city", 4, 4))
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen4-cities.pdf")
+        save_figure(savedir + "/network-gen4-cities.pdf")
 
     # add long distance connections
-    for i, comm1 in enumerate(world):
-        for comm2 in world[i+1:]:
-            dist = sqrt((comm1.x - comm2.x) ** 2 + (comm1.y - comm2.y) ** 2)
+    with phase("gen_world.city_links"):
+        radius = max(DIST_THRESHOLDS[("city", "village")],
+                     DIST_THRESHOLDS[("city", "town")],
+                     DIST_THRESHOLDS[("city", "city")])
+        cities = [i for i, comm in enumerate(world) if comm.type == "city"]
+        links = 0
+        for i, j, dist in GridIndex(world, radius).pairs_within(radius, cities):
+            comm1, comm2 = world[i], world[j]
             if comm1.type == "city" and comm2.type == "village" and \
                     dist < DIST_THRESHOLDS[("city", "village")]:
                 comm1.add_neighbor(comm2, dist)
                 comm2.add_neighbor(comm1, dist)
+                links += 1
             elif comm1.type == "city" and comm2.type == "town" and \
                     dist < DIST_THRESHOLDS[("city", "town")]:
                 comm1.add_neighbor(comm2, dist)
                 comm2.add_neighbor(comm1, dist)
+                links += 1
             elif comm1.type == "city" and comm2.type == "city" and \
                     dist < DIST_THRESHOLDS[("city", "city")]:
                 comm1.add_neighbor(comm2, dist)
                 comm2.add_neighbor(comm1, dist)
+                links += 1
+        count("gen_world.city_links.edges", links)
     if savefig:
         plot_world(world)
-        plt.savefig(savedir + "/network-gen5-city-conn.pdf")
+        save_figure(savedir + "/network-gen5-city-conn.pdf")
 
+    if use_cache:
+        cache.store(key, world)
     return world
 
 
+def _link_pairs(world, pairs, source, thresholds):
+    """
+    Link every candidate pair closer than its threshold whose first
+    community has type `source` (any type if None). Returns the number of
+    links added.
+    """
+    i, j, dist = pairs
+    codes = np.array([TYPE_CODES[comm.type] for comm in world], dtype=np.int8)
+    limits = np.array([[thresholds[(a, b)] for b in TYPES] for a in TYPES])
+    keep = dist < limits[codes[i], codes[j]]
+    if source is not None:
+        keep &= codes[i] == TYPE_CODES[source]
+    for i, j, dist in zip(i[keep].tolist(), j[keep].tolist(),
+                          dist[keep].tolist()):
+        comm1, comm2 = world[i], world[j]
+        comm1.add_neighbor(comm2, dist, thresholds)
+        comm2.add_neighbor(comm1, dist, thresholds)
+    return int(keep.sum())
+
+
+def connect_world(world, pairs, thresholds=DIST_THRESHOLDS, town_rule=(5, 5),
+                  city_rule=(4, 4)):
+    """
+    Build the network of a world of unconnected villages from its candidate
+    pairs (see spatial.candidate_pairs), with the given distance thresholds
+    and promotion rules: a village becomes a town if n_villages - a * n_towns
+    > b for town_rule (a, b), and a town a city if n_towns - a * n_cities > b
+    for city_rule. With the defaults this gives the same world as gen_world,
+    as long as the pairs reach the largest threshold.
+    """
+    with phase("connect_world.village_links"):
+        count("connect_world.village_links.edges",
+              _link_pairs(world, pairs, None, thresholds))
+    with phase("connect_world.town_promotion"):
+        count("connect_world.town_promotion.towns",
+              promote(world, "village", "town", *town_rule))
+    with phase("connect_world.town_links"):
+        count("connect_world.town_links.edges",
+              _link_pairs(world, pairs, "town", thresholds))
+    with phase("connect_world.city_promotion"):
+        count("connect_world.city_promotion.cities",
+              promote(world, "town", "city", *city_rule))
+    with phase("connect_world.city_links"):
+        count("connect_world.city_links.edges",
+              _link_pairs(world, pairs, "city", thresholds))
+    return world
+
+
+def threshold_sweep(settings, size=100, density=4, seed=None,
+                    commclass=Community, rng=None):
+    """
+    Generate one world for each of `settings`, dicts of connect_world
+    arguments (thresholds, town_rule, city_rule). The villages are placed
+    once, as gen_world would place them with this seed, and the distances
+    between them computed once, up to the largest threshold in any setting;
+    each network is then built by filtering those pairs. Yields (setting,
+    world) pairs.
+    """
+    if seed is not None and rng is not None:
+        raise ValueError("Give threshold_sweep a seed or an rng, not both.")
+    if rng is not None:
+        rng = util.make_rng(rng)
+    else:
+        if seed is None:
+            seed = random.randrange(sys.maxsize)
+        random.seed(seed)
+    logger.info(f"Sweeping {len(settings)} network settings with size={size}, "
+                f"density={density}, random seed={seed}")
+
+    with phase("threshold_sweep.placement"):
+        coords = place_villages(size, density, rng)
+    radius = max(max(setting.get('thresholds', DIST_THRESHOLDS).values())
+                 for setting in settings)
+    with phase("threshold_sweep.candidate_pairs"):
+        pairs = candidate_pairs([commclass(x, y) for x, y in coords], radius)
+    for setting in settings:
+        world = [commclass(x, y) for x, y in coords]
+        yield setting, connect_world(world, pairs, **setting)
+
+
 #
 # initialization algorithms
 #
 
-def single_locus_random_free(world):
-    start_site = random.choice(world)
+def single_locus_random_free(world, rng=None):
+    start_site = util.choice(world, rng)
     start_site.val = 1.0
 
 
-def single_locus_random_unchanging(world):
-    start_site = random.choice(world)
+def single_locus_random_unchanging(world, rng=None):
+    start_site = util.choice(world, rng)
     start_site.val = 1.0
     start_site.rate_of_change = 0
 
 
-def single_locus_unchanging_city(world):
+def single_locus_unchanging_city(world, rng=None):
     start_site = sorted(world, key=lambda c: c.size, reverse=True)[0]
     start_site.val = 1.0
     start_site.rate_of_change = 0
 
 
-def double_locus_random(world):
+def double_locus_random(world, rng=None):
     for comm in world:
         comm.val = 0.5
-    site1, site2 = random.choices(world, k=2)
+    site1, site2 = util.choices(world, 2, rng)
     site1.val = 0.0
     site2.val = 1.0
     site1.rate_of_change = 0.0
     site2.rate_of_change = 0.0
 
 
-def double_locus_opposite_cities(world):
+def double_locus_opposite_cities(world, rng=None):
     for comm in world:
         comm.val = 0.5
     site1 = sorted(world, key=lambda c: (c.size, c.x + c.y), reverse=True)[0]
@@ -226,57 +409,326 @@ def clamp(comm, val, cutoff=0.5):
         return val
 
 
-def init_sim(world, method="default"):
+def init_sim(world, method="default", rng=None):
+    # random init methods draw from `rng` if one is given, and from the
+    # global random module otherwise
     if method == "default":
-        method = single_locus
+        method = single_locus_random_free
     logger.info(f"Initializing simulation with method '{method.__name__}'.")
-    method(world)
+    if rng is None:
+        method(world)
+    else:
+        method(world, rng=util.make_rng(rng))
     logger.info("Done.")
 
 
-def run_sim(world, rounds, weighting="default", learning="default", randomize=False):
+def init_features(world, nfeatures, method="default", rng=None):
+    """
+    Give every community a vector of `nfeatures` values (and rates of
+    change), by running the init method once per feature. Each run makes
+    its own random draws (from `rng`, if given), so random init methods
+    seed every locus independently.
+    """
+    if method == "default":
+        method = single_locus_random_free
+    if hasattr(world[0], 'adult_vals'):
+        raise ValueError("Feature vectors are not supported for "
+                         "GenerationalCommunity worlds.")
+    logger.info(f"Initializing {nfeatures} features with method "
+                f"'{method.__name__}'.")
+    if rng is not None:
+        rng = util.make_rng(rng)
+    vals = [[] for comm in world]
+    rates = [[] for comm in world]
+    for f in range(nfeatures):
+        for comm in world:
+            comm.val = 0.0
+            comm.rate_of_change = 1.0
+        if rng is None:
+            method(world)
+        else:
+            method(world, rng=rng)
+        for comm, val, rate in zip(world, vals, rates):
+            val.append(comm.val)
+            rate.append(comm.rate_of_change)
+    for comm, val, rate in zip(world, vals, rates):
+        comm.val = np.array(val, dtype=float)
+        comm.rate_of_change = np.array(rate, dtype=float)
+    logger.info("Done.")
+
+
+def run_rounds(world, rounds, weighting, learning, randomize=False,
+               converge=None, frontier_tol=None, rng=None):
+    # with an rng, each round's jitter is drawn from it in one call
+    prof = profiling.active()
+    if prof is not None:
+        weighting = prof.timed("run_sim.weighting", weighting)
+        learning = prof.timed("run_sim.learning", learning)
+    if frontier_tol is not None:
+        return run_frontier_rounds(world, rounds, weighting, learning,
+                                   converge, frontier_tol)
+    for i in range(rounds):
+        with phase("run_sim.new_generation"):
+            for comm in world:
+                comm.new_generation()
+        if randomize:
+            with phase("run_sim.jitter"):
+                if rng is None:
+                    for comm in world:
+                        comm.jitter(0.05)
+                else:
+                    noise = util.jitter_noise(jitter_shape(world), rng)
+                    for comm, amt in zip(world, noise.tolist()):
+                        comm.jitter(0.05, amt)
+        with phase("run_sim.update"):
+            for comm in world:
+                weighted_input = weighting(comm)
+                newval = learning(comm, weighted_input)
+                comm.update(newval)
+        if converge is not None and converge.check(
+                [comm.hist[-1] for comm in world],
+                [comm.val for comm in world]):
+            return i + 1
+    return rounds
+
+
+def run_frontier_rounds(world, rounds, weighting, learning, converge=None,
+                        tol=1e-6):
+    """
+    Run rounds that only update the communities whose inputs have moved.
+    Every community accumulates as its drift the changes of its own and
+    its neighbors' values since its last update, so that the bookkeeping
+    only costs work where values actually change. A community whose drift
+    exceeds tol / 16 is updated in the next round. A smaller drift is not
+    dropped but delayed, for as many rounds as it would take to add up to
+    tol / 16 if it recurred every round, so that slow changes keep
+    spreading and the result stays within `tol` of a full sweep.
+    Communities that are not updated keep their value, so a round costs in
+    proportion to the communities it updates.
+
+    History is recorded lazily: a community's missing rounds (all at its
+    unchanged value) are filled in when it is next updated or in the round
+    after it changed, and for every community at the end.
+    """
+    store = get_history(world)
+    # a DiskHistory can only hold one chunk of ragged rounds in memory
+    limit = len(store.data) if isinstance(store, DiskHistory) else None
+    if store is not None:
+        store.flush()
+    comms = list(world)
+    n = len(comms)
+    index = {comm: k for k, comm in enumerate(comms)}
+    # the communities whose weighted input reads each community's value,
+    # in CSR form
+    src, dst = list(range(n)), list(range(n))
+    for k, comm in enumerate(comms):
+        for other in comm.neighbors:
+            src.append(index[other])
+            dst.append(k)
+    src = np.array(src, dtype=np.int64)
+    readers = np.array(dst, dtype=np.int64)[np.argsort(src, kind="stable")]
+    readers_ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=readers_ptr[1:])
+
+    recorded = [-1] * n
+    drift = np.zeros(n)
+    # the round each community is due for an update, `rounds` for none
+    scheduled = np.full(n, rounds, dtype=np.int64)
+    threshold = tol / 16
+
+    def catch_up(k, t):
+        comm = comms[k]
+        for _ in range(t - recorded[k]):
+            comm.new_generation()
+        recorded[k] = t
+
+    synced = 0
+    frontier = list(range(n))
+    changed = []
+    done = rounds
+    for i in range(rounds):
+        with phase("run_sim.new_generation"):
+            if limit is not None and i - synced >= limit:
+                for k in range(n):
+                    catch_up(k, i - 1)
+                store.flush()
+                synced = i
+            # communities changed last round, as their neighbors read
+            # hist[-1], and those about to change
+            for k in itertools.chain(changed, frontier):
+                gap = i - recorded[k]
+                if gap:
+                    comm = comms[k]
+                    for _ in range(gap):
+                        comm.new_generation()
+                    recorded[k] = i
+        with phase("run_sim.update"):
+            changed = []
+            changes = []
+            for k in frontier:
+                comm = comms[k]
+                old = comm.val
+                weighted_input = weighting(comm)
+                newval = learning(comm, weighted_input)
+                comm.update(newval)
+                if comm.val != old:
+                    changed.append(k)
+                    changes.append(abs(comm.val - old))
+        # communities that were not updated did not change
+        if converge is not None and converge.check(
+                [comms[k].hist[-1] for k in frontier],
+                [comms[k].val for k in frontier]):
+            done = i + 1
+            break
+        with phase("run_sim.frontier"):
+            drift[frontier] = 0.0
+            scheduled[frontier] = rounds
+            if changed:
+                ks = np.array(changed)
+                counts = readers_ptr[ks + 1] - readers_ptr[ks]
+                starts = np.repeat(readers_ptr[ks] - np.cumsum(counts)
+                                   + counts, counts)
+                rows = readers[starts + np.arange(len(starts))]
+                drift += np.bincount(rows, np.repeat(changes, counts),
+                                     minlength=n)
+                rows = np.flatnonzero(np.bincount(rows, minlength=n))
+                t = i + 1 + np.minimum(threshold / drift[rows],
+                                       rounds).astype(np.int64)
+                scheduled[rows] = np.minimum(scheduled[rows], t)
+            # in world order, like a full sweep
+            frontier = np.flatnonzero(scheduled == i + 1).tolist()
+    with phase("run_sim.new_generation"):
+        for k in range(n):
+            catch_up(k, done - 1)
+    return done
+
+
+def jitter_shape(world):
+    """Shape of one round of jitter noise, as drawn by every backend."""
+    if len(world) and hasattr(world[0], 'adult_vals'):
+        return (len(world), NUM_GENERATIONS)
+    return (len(world),)
+
+
+def pad_history(world, rounds):
+    """Extend the history as if the world stayed at its current values for
+    `rounds` more rounds."""
+    store = get_history(world)
+    if store is not None:
+        vals = [comm.val for comm in world]
+        for i in range(rounds):
+            store.append_row(vals)
+    else:
+        for comm in world:
+            comm.hist.extend([comm.val] * rounds)
+
+
+def run_sim(world, rounds, weighting="default", learning="default", randomize=False,
+            backend="object", history=None, start_round=0, checkpoint=None,
+            checkpoint_every=None, checkpoint_meta=None, converge=None,
+            pad=False, frontier_tol=None, workers=None, rng=None):
     if weighting == "default":
         weighting = neighbor_weighted_update
     if learning == "default":
         learning = copy_input
 
-    logger.info(f"Running simulation with weighting method '{weighting.__name__}' "
-                f"and learning method '{learning}'.")
-    for i in range(rounds):
-        for comm in world:
-            comm.new_generation()
-            if randomize:
-                comm.jitter(0.05)
-        for comm in world:
-            weighted_input = weighting(comm)
-            newval = learning(comm, weighted_input)
-            comm.update(newval)
+    name = getattr(weighting, '__name__', weighting)
+    logger.info(f"Running simulation with weighting method '{name}' "
+                f"and learning method '{learning}' on backend '{backend}'.")
+    store = use_history(world, history, rounds - start_round)
+    if frontier_tol is not None:
+        if backend != "object":
+            raise ValueError("Frontier scheduling needs backend='object'.")
+        if randomize:
+            raise ValueError("Frontier scheduling cannot be combined with "
+                             "randomize, which changes every community.")
+        if len(world) and hasattr(world[0], 'adult_vals'):
+            raise ValueError("Frontier scheduling is not supported for "
+                             "GenerationalCommunity worlds, whose values "
+                             "keep changing after an update.")
+    if backend == "object" and world_features(world) is not None:
+        raise ValueError("Feature vectors need backend='array' or "
+                         "'parallel'.")
+    if backend == "array":
+        import vecsim
+        run = partial(vecsim.run_sim, history=store)
+    elif backend == "parallel":
+        import parallel
+        run = partial(parallel.run_sim, history=store, workers=workers)
+    elif backend == "object":
+        run = partial(run_rounds, frontier_tol=frontier_tol)
+    else:
+        raise ValueError(f"No such backend: {backend}")
+
+    if converge is not None:
+        converge.reset()
+    if rng is not None:
+        rng = util.make_rng(rng)
+
+    converged = None
+    step = max(checkpoint_every or rounds - start_round, 1)
+    for start in range(start_round, rounds, step):
+        stop = min(start + step, rounds)
+        done = run(world, stop - start, weighting, learning, randomize,
+                   converge=converge, rng=rng)
+        if done < stop - start:
+            converged = stop = start + done
+            logger.info(f"Converged after round {converged}.")
+            if pad:
+                pad_history(world, rounds - converged)
+        if store is not None:
+            store.flush()
+        if checkpoint is not None:
+            logger.info(f"Saving checkpoint '{checkpoint}' at round {stop}.")
+            save_checkpoint(world, checkpoint, round=stop, rng=rng,
+                            **(checkpoint_meta or {}))
+        if converged is not None:
+            break
     logger.info("Done.")
+    return converged
 
 
 def sim_simple(world, rounds, init="default", weighting="default",
                learning="default", randomize=False, interactive=False,
-               savefig=False, savedir="figs", color="values"):
+               savefig=False, savedir="figs", color="values", backend="object",
+               history=None, async_savefig=False):
+    import matplotlib.pyplot as plt
+    from plotting import plot_world, plot_val_by_comm, plot_avg_val
+
     init_sim(world, method=init)
 
-    plot_world(world, color=color)
+    # network figures can be rendered in the background from a snapshot
+    writer = None
+    if savefig and async_savefig:
+        from export import FrameWriter
+        writer = FrameWriter(world, color=color)
+
+    if writer is None or interactive:
+        plot_world(world, color=color)
     if interactive:
         plt.show()
     if savefig:
         filename = "network-sim-start.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        if writer is not None:
+            writer.submit(world_values(world), f"{savedir}/{filename}")
+        else:
+            save_figure(f"{savedir}/{filename}")
 
     run_sim(world, rounds, weighting=weighting, learning=learning,
-            randomize=randomize)
+            randomize=randomize, backend=backend, history=history)
 
-    plot_world(world, color=color)
+    if writer is None or interactive:
+        plot_world(world, color=color)
     if interactive:
         plt.show()
     if savefig:
         filename = "network-sim-end.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        if writer is not None:
+            writer.submit(world_values(world), f"{savedir}/{filename}")
+        else:
+            save_figure(f"{savedir}/{filename}")
 
     plot_val_by_comm(world)
     if interactive:
@@ -284,7 +736,7 @@ def sim_simple(world, rounds, init="default", weighting="default",
     if savefig:
         filename = "sim-results-by-comm.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        save_figure(f"{savedir}/{filename}")
 
     plot_avg_val(world)
     if interactive:
@@ -292,10 +744,18 @@ def sim_simple(world, rounds, init="default", weighting="default",
     if savefig:
         filename = "sim-results-avg.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        save_figure(f"{savedir}/{filename}")
+
+    if writer is not None:
+        writer.close()
+
 
+def interactive_view(world, color="values", feature=None):
+    import matplotlib.pyplot as plt
+    from plotting import plot_world
+
+    feature = default_feature(world, feature)
 
-def interactive_view(world):
     rounds = len(world[0].hist)
     currtime = 0
 
@@ -316,28 +776,29 @@ def interactive_view(world):
         currtime = currtime % rounds
         print(f"now at time: {currtime}")
 
-        plt.cla()
-        plot_world(world, color="values", t=currtime)
-        fig.canvas.draw()
+        view.set_values(world_values(world, t=currtime, feature=feature))
+        fig.canvas.draw_idle()
 
     fig = plt.gcf()
     fig.canvas.mpl_connect('key_press_event', key_event)
-    plot_world(world, color="values", t=currtime)
+    view = plot_world(world, color=color, t=currtime, feature=feature)
     plt.show()
 
 
-def demo_worldgen(seed=None):
+def demo_worldgen(seed=None, profile=False, trace_memory=False):
     savefig = True
     savedir = "results-worldgen"
-    init_savedir(savedir)
+    init_savedir(savedir, profile=profile, trace_memory=trace_memory)
 
     gen_world(size=50, density=4, savefig=savefig, savedir=savedir)
+    write_metrics(savedir)
 
 
-def demo_simple(seed=None, interactive=False):
+def demo_simple(seed=None, interactive=False, profile=False,
+                trace_memory=False):
     savefig = True
     savedir = "results-single-locus"
-    init_savedir(savedir)
+    init_savedir(savedir, profile=profile, trace_memory=trace_memory)
 
     world = gen_world(size=50, density=4)
     sim_simple(
@@ -345,14 +806,16 @@ def demo_simple(seed=None, interactive=False):
         init=single_locus_unchanging_city,
         weighting=neighbor_size_dist_weighted_update,
         savefig=savefig, savedir=savedir)
+    write_metrics(savedir)
     if interactive:
         interactive_view(world)
 
 
-def demo_double_locus(seed=None, interactive=False):
+def demo_double_locus(seed=None, interactive=False, profile=False,
+                      trace_memory=False):
     savefig = True
     savedir = "results-double-locus"
-    init_savedir(savedir)
+    init_savedir(savedir, profile=profile, trace_memory=trace_memory)
 
     world = gen_world(size=50, density=4)
     sim_simple(
@@ -360,16 +823,18 @@ def demo_double_locus(seed=None, interactive=False):
         init=double_locus_opposite_cities,
         weighting=neighbor_size_dist_weighted_update,
         savefig=savefig, savedir=savedir, color="values-twocolor")
+    write_metrics(savedir)
     if interactive:
-        interactive_view(world)
+        interactive_view(world, color="values-twocolor")
 
 
-def demo_generations(seed=None, interactive=False):
+def demo_generations(seed=None, interactive=False, profile=False,
+                     trace_memory=False):
     import lowbackmerger as lbm
 
     savefig = True
     savedir = "results-generations"
-    init_savedir(savedir)
+    init_savedir(savedir, profile=profile, trace_memory=trace_memory)
 
     world = gen_world(size=50, density=4,
                       commclass=lbm.GenerationalCommunity)
@@ -379,76 +844,104 @@ def demo_generations(seed=None, interactive=False):
         weighting=neighbor_size_dist_weighted_update,
         learning=clamp,
         savefig=savefig, savedir=savedir, color="values-twocolor")
+    write_metrics(savedir)
     if interactive:
-        interactive_view(world)
+        interactive_view(world, color="values-twocolor")
 
 
-def lowbackmerger_main(seed=None):
-    from functools import partial
+def lowbackmerger_main(seed=None, resume=False, checkpoint_every=None,
+                       async_savefig=False, profile=False,
+                       trace_memory=False):
     import lowbackmerger as lbm
+    from plotting import plot_world, plot_val_by_comm, plot_avg_val
 
     savefig = True
     savedir = "results-lbm"
-    init_savedir(savedir)
+    init_savedir(savedir, profile=profile, trace_memory=trace_memory)
+    checkpoint = f"{savedir}/checkpoint.npz"
 
     clamp50 = partial(clamp, cutoff=0.5)
     # clamp20 = partial(clamp, cutoff=0.2)
 
-    world = gen_world(size=100, density=4,
-                      commclass=lbm.GenerationalCommunity)
-
-    init_sim(world, method=double_locus_opposite_cities)
+    # (figure name, rounds, learning, randomize)
+    phases = [("network-sim-dialect-spread.pdf", 10, copy_input, False),
+              ("network-sim-dialect-crystalize.pdf", 40, clamp50, False),
+              ("network-sim-randomize.pdf", 50, clamp50, True)]
 
-    plot_world(world, color="values-twocolor")
-    if savefig:
-        filename = "network-sim-start.pdf"
-        logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
-
-    run_sim(world, rounds=10,
-            weighting=neighbor_size_dist_weighted_update,
-            learning=copy_input,
-            randomize=False)
-
-    plot_world(world, color="values-twocolor")
-    if savefig:
-        filename = "network-sim-dialect-spread.pdf"
-        logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+    if resume and os.path.exists(checkpoint):
+        world, meta = load_checkpoint(checkpoint)
+        start_phase, start_round = meta["phase"], meta["round"]
+        logger.info(f"Resuming from '{checkpoint}' at phase {start_phase}, "
+                    f"round {start_round}.")
+    else:
+        world = gen_world(size=100, density=4, seed=seed,
+                          commclass=lbm.GenerationalCommunity)
 
-    run_sim(world, rounds=40,
-            weighting=neighbor_size_dist_weighted_update,
-            learning=clamp50,
-            randomize=False)
+        init_sim(world, method=double_locus_opposite_cities)
+        start_phase, start_round = 0, 0
 
-    plot_world(world, color="values-twocolor")
-    if savefig:
-        filename = "network-sim-dialect-crystalize.pdf"
-        logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+    writer = None
+    if savefig and async_savefig:
+        from export import FrameWriter
+        writer = FrameWriter(world, color="values-twocolor")
 
-    run_sim(world, rounds=50,
-            weighting=neighbor_size_dist_weighted_update,
-            learning=clamp50,
-            randomize=True)
+    if start_phase == 0 and start_round == 0:
+        filename = "network-sim-start.pdf"
+        if writer is not None:
+            logger.info(f"Saving figure {filename}.")
+            writer.submit(world_values(world), f"{savedir}/{filename}")
+        else:
+            plot_world(world, color="values-twocolor")
+            if savefig:
+                logger.info(f"Saving figure {filename}.")
+                save_figure(f"{savedir}/{filename}")
 
-    plot_world(world, color="values-twocolor")
-    if savefig:
-        filename = "network-sim-randomize.pdf"
-        logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+    for i, (filename, rounds, learning, randomize) in enumerate(phases):
+        if i < start_phase:
+            continue
+        run_sim(world, rounds=rounds,
+                weighting=neighbor_size_dist_weighted_update,
+                learning=learning,
+                randomize=randomize,
+                start_round=start_round if i == start_phase else 0,
+                checkpoint=checkpoint if checkpoint_every else None,
+                checkpoint_every=checkpoint_every,
+                checkpoint_meta={"phase": i})
+        # mark the phase boundary so that a resume starts the next phase
+        save_checkpoint(world, checkpoint, phase=i + 1, round=0)
+
+        if writer is not None:
+            logger.info(f"Saving figure {filename}.")
+            writer.submit(world_values(world), f"{savedir}/{filename}")
+        else:
+            plot_world(world, color="values-twocolor")
+            if savefig:
+                logger.info(f"Saving figure {filename}.")
+                save_figure(f"{savedir}/{filename}")
 
     plot_val_by_comm(world)
     if savefig:
         filename = "sim-results-by-comm.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        save_figure(f"{savedir}/{filename}")
 
     plot_avg_val(world)
     if savefig:
         filename = "sim-results-avg.pdf"
         logger.info(f"Saving figure {filename}.")
-        plt.savefig(f"{savedir}/{filename}")
+        save_figure(f"{savedir}/{filename}")
+
+    if writer is not None:
+        writer.close()
+    write_metrics(savedir)
+
+
+# a star import only sees the lazily imported plotting names (and plt) if
+# they are listed, so __all__ names them next to everything defined here
+__all__ = [name for name, value in globals().items()
+           if not name.startswith("_")
+           and not isinstance(value, types.ModuleType)]
+__all__ += list(PLOTTING_NAMES) + ["plt"]
 
 
 if __name__ == "__main__":
@@ -12,10 +12,15 @@ class GenerationalCommunity:
         self.y = y
         self.type = commtype
         self.children_val = 0.0
-        self.adult_vals = [0.0] * NUM_GENERATIONS
+        # circular buffer of the last NUM_GENERATIONS adult cohorts, oldest
+        # at self._head; the mean is cached until the buffer changes
+        self._adults = [0.0] * NUM_GENERATIONS
+        self._head = 0
+        self._val = 0.0
         self.rate_of_change = 1.0
         self.hist = []
         self.neighbors = {}
+        self._ind_neighbors = None
 
     def to_dict(self, t="now"):
         if t == "now":
@@ -29,35 +34,54 @@ class GenerationalCommunity:
     def size(self):
         return COMM_SIZES[self.type]
 
+    @property
+    def adult_vals(self):
+        return self._adults[self._head:] + self._adults[:self._head]
+
+    @adult_vals.setter
+    def adult_vals(self, vals):
+        self._adults = list(vals[-NUM_GENERATIONS:])
+        self._head = 0
+        self._val = None
+
     @property
     def val(self):
-        return mean(self.adult_vals[-NUM_GENERATIONS:])
+        if self._val is None:
+            self._val = mean(self._adults)
+        return self._val
 
     @val.setter
     def val(self, newval):
         self.children_val = newval
-        self.adult_vals = [newval for _ in self.adult_vals]
+        self._adults = [newval] * NUM_GENERATIONS
+        self._val = None
 
     def new_generation(self):
         self.hist.append(self.val)
-        self.adult_vals.append(self.children_val)
+        self._adults[self._head] = self.children_val
+        self._head = (self._head + 1) % NUM_GENERATIONS
+        self._val = None
 
     def update(self, newval):
         # self.children_val = newval
         self.children_val = self.val + self.rate_of_change * (newval - self.val)
 
-    def jitter(self, amt):
-        for i in range(-NUM_GENERATIONS, 0):
-            self.adult_vals[i] = util.random_jitter(self.adult_vals[i], amt)
+    def jitter(self, amt, noise=None):
+        # noise, if given, has one value per cohort, oldest first
+        for i in range(NUM_GENERATIONS):
+            j = (self._head + i) % NUM_GENERATIONS
+            self._adults[j] = util.random_jitter(
+                self._adults[j], amt, None if noise is None else noise[i])
+        self._val = None
 
     @property
     def ind_neighbors(self):
-        return [nn for n in self.neighbors for nn in n.neighbors
-                if nn not in self.neighbors]
+        return cached_ind_neighbors(self)
 
-    def add_neighbor(self, other, dist):
-        threshold = DIST_THRESHOLDS[(self.type, other.type)]
+    def add_neighbor(self, other, dist, thresholds=DIST_THRESHOLDS):
+        threshold = thresholds[(self.type, other.type)]
         self.neighbors[other] = (threshold - dist) / threshold
+        graph_changed()
 
 
 # def double_locus_opposite_cities(world):
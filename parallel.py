@@ -0,0 +1,260 @@
+"""
+Shared-memory simulation engine for running one world on several cores.
+
+The world is split into spatially compact partitions, one per worker
+process. The state vectors live in multiprocessing.shared_memory and are
+never pickled: every round each worker reads the values of its
+communities and their neighbors from the previous round's buffer (the
+values the weighting functions see as hist[-1]), writes its own
+communities' new values to the other buffer, and signals the main
+process, which records the history, checks for convergence and starts
+the next round. The two buffers swap roles each round. The handshake uses
+semaphores rather than a barrier, so that a worker killed in the middle
+of it (e.g. by the OOM killer) cannot leave a lock held: the main process
+notices the exit and stops the others.
+
+Each worker runs the vecsim kernels on a small CSR matrix of its own rows
+(with their neighbors in the same order as in the whole world), so the
+results are the same as with the array backend. Jitter noise is drawn by
+the main process, in the same order as on the other backends.
+"""
+
+import os
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+from scipy import sparse
+
+import vecsim
+from util import jitter_noise
+from lowbackmerger import NUM_GENERATIONS
+from world import World
+
+
+def partition(x, y, parts):
+    """
+    Split the community ids into `parts` spatially compact groups of
+    nearly equal size, by recursive bisection along alternating axes.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    def split(ids, parts, axis):
+        if parts == 1:
+            return [np.sort(ids)]
+        left = parts // 2
+        coord = (x if axis == 0 else y)[ids]
+        ids = ids[np.argsort(coord, kind="stable")]
+        cut = len(ids) * left // parts
+        return (split(ids[:cut], left, 1 - axis)
+                + split(ids[cut:], parts - left, 1 - axis))
+
+    return split(np.arange(len(x)), parts, 0)
+
+
+class LocalWorld:
+    """
+    The part of a CompiledWorld one worker needs: its own communities
+    (first) and their neighbors from other partitions (after them), with
+    the complete neighbor rows of its own communities only.
+    """
+
+    def __init__(self, cw, owned):
+        rows = cw.weights[owned]
+        ghosts = np.setdiff1d(rows.indices, owned)
+        self.owned = owned
+        self.ids = np.concatenate([owned, ghosts])
+        n = len(self.ids)
+        lookup = np.full(cw.n, -1, dtype=np.int64)
+        lookup[self.ids] = np.arange(n)
+        indptr = np.concatenate(
+            [rows.indptr, np.full(len(ghosts), rows.indptr[-1])])
+        self.n = n
+        self.weights = sparse.csr_matrix(
+            (rows.data, lookup[rows.indices], indptr), shape=(n, n))
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(len(rows.data)), self.weights.indices,
+             self.weights.indptr), shape=(n, n))
+        self.degree = np.diff(self.weights.indptr).astype(float)
+        self.size = cw.size[self.ids]
+        self.rate = cw.rate[owned]
+
+
+class SharedArrays:
+    """NumPy arrays backed by named shared memory blocks."""
+
+    def __init__(self, shapes=None, names=None):
+        self.blocks = {}
+        self.arrays = {}
+        if names is None:
+            for key, shape in shapes.items():
+                nbytes = max(int(np.prod(shape)) * 8, 1)
+                self.blocks[key] = shared_memory.SharedMemory(
+                    create=True, size=nbytes)
+            self.shapes = shapes
+        else:
+            for key, name in names.items():
+                self.blocks[key] = shared_memory.SharedMemory(name=name)
+            self.shapes = shapes
+        for key, shape in self.shapes.items():
+            self.arrays[key] = np.ndarray(shape, dtype=float,
+                                          buffer=self.blocks[key].buf)
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    @property
+    def names(self):
+        return {key: block.name for key, block in self.blocks.items()}
+
+    def close(self, unlink=False):
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+def _worker(local, names, shapes, rounds, head, weight_fn, learn_fn,
+            randomize, go, done):
+    shared = SharedArrays(shapes, names)
+    owned, k = local.owned, len(local.owned)
+    bufs = (shared['val0'], shared['val1'])
+    control, noise = shared['control'], shared['noise']
+    generational = 'adults' in shapes
+    try:
+        for i in range(rounds):
+            go.acquire()
+            if control[0]:
+                break
+            prev, cur = bufs[i % 2], bufs[(i + 1) % 2]
+            h = prev[local.ids]
+            if generational:
+                adults, children = shared['adults'], shared['children']
+                block = adults[owned]
+                block[:, head] = children[owned]
+                head = (head + 1) % NUM_GENERATIONS
+                # oldest cohort first, as in vecsim.GenerationalState
+                cols = (head + np.arange(NUM_GENERATIONS)) % NUM_GENERATIONS
+                if randomize:
+                    block[:, cols] = np.clip(
+                        block[:, cols] + 0.05 * noise[owned], 0.0, 1.0)
+                adults[owned] = block
+                val = block[:, cols].mean(axis=1)
+            else:
+                val = h[:k]
+                if randomize:
+                    val = np.clip(val + 0.05 * noise[owned], 0.0, 1.0)
+            newvals = learn_fn(local, weight_fn(local, h))[:k]
+            newvals = val + local.rate * (newvals - val)
+            if generational:
+                shared['children'][owned] = newvals
+                cur[owned] = val
+            else:
+                cur[owned] = newvals
+            done.release()
+    finally:
+        shared.close()
+
+
+def _collect(done, procs, poll=0.1):
+    """
+    Wait until every worker has finished its round. Raises RuntimeError if
+    a worker exits with an error in the meantime, including one killed
+    without a chance to report it.
+    """
+    for _ in procs:
+        while not done.acquire(timeout=poll):
+            codes = [proc.exitcode for proc in procs]
+            if any(code not in (None, 0) for code in codes):
+                raise RuntimeError(f"A worker of the parallel backend "
+                                   f"failed (exit codes {codes}).")
+
+
+def run_sim(world, rounds, weighting, learning, randomize=False, history=None,
+            converge=None, workers=None, rng=None):
+    """
+    Run up to `rounds` rounds of the world on `workers` processes and
+    write the final state and history back, like vecsim.run_sim. Returns
+    the number of rounds run.
+    """
+    workers = workers or os.cpu_count()
+    cw = vecsim.CompiledWorld(world)
+    state = vecsim.world_state(world)
+    weight_fn = vecsim.compile_rule(weighting, vecsim.WEIGHTING_KERNELS)
+    learn_fn = vecsim.compile_rule(learning, vecsim.LEARNING_KERNELS)
+    generational = isinstance(state, vecsim.GenerationalState)
+
+    shapes = {'val0': state.val.shape, 'val1': state.val.shape,
+              'control': (1,)}
+    if generational:
+        shapes['adults'] = state.adults.shape
+        shapes['children'] = (cw.n,)
+        shapes['noise'] = state.adults.shape
+    else:
+        shapes['noise'] = state.val.shape
+    shared = SharedArrays(shapes)
+    shared['val0'][:] = state.val
+    shared['control'][0] = 0
+    if generational:
+        shared['adults'][:] = state.adults
+        shared['children'][:] = state.children
+
+    if isinstance(world, World):
+        x, y = world.x, world.y
+    else:
+        x = [comm.x for comm in world]
+        y = [comm.y for comm in world]
+    parts = [LocalWorld(cw, owned)
+             for owned in partition(x, y, min(workers, max(cw.n, 1)))]
+
+    ctx = get_context()
+    gos = [ctx.Semaphore(0) for _ in parts]
+    done = ctx.Semaphore(0)
+    procs = [ctx.Process(target=_worker, daemon=True,
+                         args=(local, shared.names, shapes, rounds,
+                               state.head if generational else 0,
+                               weight_fn, learn_fn, randomize, go, done))
+             for local, go in zip(parts, gos)]
+    for proc in procs:
+        proc.start()
+
+    hist = np.empty((rounds,) + state.val.shape) if history is None else None
+    ran = rounds
+    try:
+        for i in range(rounds):
+            if randomize:
+                shared['noise'][:] = jitter_noise(shapes['noise'], rng)
+            for go in gos:
+                go.release()
+            h = shared[f'val{i % 2}']
+            if history is None:
+                hist[i] = h
+            else:
+                history.append_row(h)
+            _collect(done, procs)
+            if converge is not None and converge.check(
+                    h, shared[f'val{(i + 1) % 2}']):
+                ran = i + 1
+                shared['control'][0] = 1
+                for go in gos:
+                    go.release()
+                break
+        state.val = shared[f'val{ran % 2}'].copy()
+        if generational:
+            state.adults = shared['adults'].copy()
+            state.children = shared['children'].copy()
+            state.head = (state.head + ran) % NUM_GENERATIONS
+    except BaseException:
+        for proc in procs:
+            proc.terminate()
+        raise
+    finally:
+        for proc in procs:
+            proc.join()
+        shared.close(unlink=True)
+
+    state.write_back(world)
+    if history is None:
+        vecsim.extend_hist(world, hist[:ran])
+    return ran
@@ -1,18 +1,61 @@
 """
 Functions for plotting network and simulation results with matplotlib.
+
+Nothing else in the simulation core imports this module (or matplotlib)
+until a plot is asked for. Set LINGNETSIM_HEADLESS=1 to run without a
+display: figures are then drawn with the non-interactive Agg backend and
+can only be saved, not shown.
 """
 
+import os
 from statistics import mean
+
+import matplotlib
+if os.environ.get("LINGNETSIM_HEADLESS"):
+    matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 from matplotlib import collections as mc
-import pandas as pd
+import numpy as np
+
+from history import default_feature, get_history, world_values
+from profiling import phase
+
+TYPE_COLORS = {'village': 0, 'town': 0.5, 'city': 1}
+TYPE_SIZES = {'village': 30, 'town': 90, 'city': 200}
+CONNECTION_COLORS = {('village', 'village'): "C0",
+                     ('town', 'village'): "C1",
+                     ('village', 'town'): "C1",
+                     ('town', 'town'): "C2",
+                     ('city', 'village'): "C3",
+                     ('village', 'city'): "C3",
+                     ('city', 'town'): "C4",
+                     ('town', 'city'): "C4",
+                     ('city', 'city'): "C5"}
+
+# colormap and marker edge color for each node color scheme
+NODE_SCHEMES = {"community_type": (None, None),
+                "values": ("Reds", "black"),
+                "values-twocolor": ("RdBu", "black"),
+                None: (None, None)}
+
+# node and edge color scheme for each world color scheme
+WORLD_SCHEMES = {"default": ("community_type", None),
+                 "values": ("values", None),
+                 "values-twocolor": ("values-twocolor", None)}
 
 
 def plot_nodes(world, color=None, t="now"):
-    df = pd.DataFrame.from_records(comm.to_dict(t=t) for comm in world)
+    import pandas as pd
+
+    store = get_history(world)
+    if store is not None and t != "now":
+        df = pd.DataFrame.from_records(comm.to_dict() for comm in world)
+        df['val'] = store.round(t)
+    else:
+        df = pd.DataFrame.from_records(comm.to_dict(t=t) for comm in world)
 
-    colors = {'village': 0, 'town': 0.5, 'city': 1}
-    sizes = {'village': 30, 'town': 90, 'city': 200}
+    colors = TYPE_COLORS
+    sizes = TYPE_SIZES
 
     if color == "community_type":
         cdata = df['type'].map(colors)
@@ -40,15 +83,7 @@ def plot_nodes(world, color=None, t="now"):
 
 def plot_edges(edges, ax, color=None):
     lines = [((c1.x, c1.y), (c2.x, c2.y)) for (c1, c2) in edges]
-    colormap = {('village', 'village'): "C0",
-                ('town', 'village'): "C1",
-                ('village', 'town'): "C1",
-                ('town', 'town'): "C2",
-                ('city', 'village'): "C3",
-                ('village', 'city'): "C3",
-                ('city', 'town'): "C4",
-                ('town', 'city'): "C4",
-                ('city', 'city'): "C5"}
+    colormap = CONNECTION_COLORS
 
     if color == "connection_type":
         cdata = [colormap[(c1.type, c2.type)] for (c1, c2) in edges]
@@ -61,41 +96,123 @@ def plot_edges(edges, ax, color=None):
     ax.add_collection(lc)
 
 
-def plot_world(world, color="default", t="now"):
-    plt.cla()
-    plt.tight_layout()
-    edges = {(c1, c2) for c1 in world for c2 in c1.neighbors}
-    ax = plt.gca()
-
-    node_color = None
-    edge_color = None
-    if color == "values":
-        node_color = "values"
-        edge_color = None
-    elif color == "values-twocolor":
-        node_color = "values-twocolor"
-        edge_color = None
-    elif color == "default":
-        node_color = "community_type"
-        edge_color = None
-    else:
-        raise ValueError(f"No such color scheme: {color}")
-
-    plot_nodes(world, color=node_color, t=t)
-    plot_edges(edges, ax, color=edge_color)
-
-
-def plot_val_by_comm(world):
+class WorldGeometry:
+    """
+    Node positions, sizes and edge segments of a world, computed once and
+    shared by every plot of it.
+    """
+
+    def __init__(self, world):
+        index = {comm: i for i, comm in enumerate(world)}
+        self.x = np.array([comm.x for comm in world], dtype=float)
+        self.y = np.array([comm.y for comm in world], dtype=float)
+        self.types = [comm.type for comm in world]
+        self.sizes = np.array([TYPE_SIZES[t] for t in self.types])
+        self.type_colors = np.array([TYPE_COLORS[t] for t in self.types])
+        # one segment per direction, like plot_edges, so lines keep their
+        # usual weight
+        pairs = [(i, index[other]) for i, comm in enumerate(world)
+                 for other in comm.neighbors]
+        self.segments = np.array(
+            [((self.x[i], self.y[i]), (self.x[j], self.y[j]))
+             for i, j in pairs]).reshape(-1, 2, 2)
+        self.edge_types = [(self.types[i], self.types[j]) for i, j in pairs]
+
+
+class WorldView:
+    """
+    Scatter and edge artists for a world, built once. Showing another point
+    in time only replaces the scatter's color array.
+    """
+
+    def __init__(self, geometry, color="default", values=None, ax=None):
+        if color not in WORLD_SCHEMES:
+            raise ValueError(f"No such color scheme: {color}")
+        node_color, edge_color = WORLD_SCHEMES[color]
+        if ax is None:
+            ax = plt.gca()
+        self.geometry = geometry
+        self.ax = ax
+
+        cmap, edgecolor = NODE_SCHEMES[node_color]
+        if node_color == "community_type":
+            cdata = geometry.type_colors
+        elif node_color is None:
+            cdata = None
+        elif values is None:
+            cdata = np.zeros(len(geometry.x))
+        else:
+            cdata = np.asarray(values, dtype=float)
+        self.nodes = ax.scatter(geometry.x, geometry.y, s=geometry.sizes,
+                                c=cdata, cmap=cmap, vmin=0, vmax=1,
+                                edgecolors=edgecolor, linewidths=0.5)
+
+        if edge_color == "connection_type":
+            edata = [CONNECTION_COLORS[pair] for pair in geometry.edge_types]
+        elif edge_color is None:
+            edata = "gray"
+        else:
+            raise ValueError(f"No such color scheme: {edge_color}")
+        self.edges = mc.LineCollection(geometry.segments, colors=edata,
+                                       linewidths=0.5, zorder=0)
+        ax.add_collection(self.edges)
+
+    def set_values(self, values):
+        self.nodes.set_array(np.asarray(values, dtype=float))
+
+
+def _hist_array(world, start, stop, feature):
+    """(rounds x communities) history of one feature, and its rounds."""
+    store = get_history(world)
+    if store is not None:
+        start, stop, _ = slice(start, stop).indices(len(store))
+        return range(start, stop), store.feature(feature, start, stop)
+    start, stop, _ = slice(start, stop).indices(len(world[0].hist))
+    hist = np.array([comm.hist[start:stop] for comm in world], dtype=float)
+    return range(start, stop), hist[..., feature].T
+
+
+def plot_world(world, color="default", t="now", feature=None):
+    feature = default_feature(world, feature)
+    with phase("plot_world"):
+        plt.cla()
+        plt.tight_layout()
+        return WorldView(WorldGeometry(world), color=color,
+                         values=world_values(world, t, feature))
+
+
+def plot_val_by_comm(world, start=None, stop=None, feature=None):
+    feature = default_feature(world, feature)
     plt.cla()
     plt.tight_layout()
+    if feature is not None:
+        rounds, hist = _hist_array(world, start, stop, feature)
+        plt.plot(rounds, hist, linewidth=0.5)
+        return
+    store = get_history(world)
+    if store is not None:
+        start, stop, _ = slice(start, stop).indices(len(store))
+        plt.plot(range(start, stop), store.array(start, stop), linewidth=0.5)
+        return
     rounds = len(world[0].hist)
     for comm in world:
         plt.plot(range(rounds), comm.hist, linewidth=0.5)
 
 
-def plot_avg_val(world):
+def plot_avg_val(world, start=None, stop=None, feature=None):
+    feature = default_feature(world, feature)
     plt.cla()
     plt.tight_layout()
+    if feature is not None:
+        rounds, hist = _hist_array(world, start, stop, feature)
+        plt.plot(rounds, hist.mean(axis=1, dtype=float))
+        return
+    store = get_history(world)
+    if store is not None:
+        start, stop, _ = slice(start, stop).indices(len(store))
+        plt.plot(range(start, stop),
+                 store.array(start, stop).mean(axis=1, dtype=float))
+        return
     rounds = len(world[0].hist)
     plt.plot(range(rounds),
              [mean(comm.hist[i] for comm in world) for i in range(rounds)])
@@ -0,0 +1,120 @@
+"""
+Opt-in timing and resource instrumentation.
+
+Code marks its phases with `with phase("name"):` and reports quantities
+with count(). Both do nothing until enable() is called; after that every
+phase records its wall time and number of calls (and, with trace_memory,
+the peak memory traced by tracemalloc while it ran), and write_metrics()
+dumps everything as JSON.
+"""
+
+import json
+import resource
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_profiler = None
+
+
+class Profiler:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.counts = {}
+        self._peaks = []
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _record(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'calls': 0, 'wall': 0.0}
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self, name):
+        if self.trace_memory:
+            # tracemalloc keeps a single peak, so each open phase keeps the
+            # highest peak of its parts before a nested phase reset it
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1],
+                                      tracemalloc.get_traced_memory()[1])
+            self._peaks.append(0)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self._record(name)
+            record['calls'] += 1
+            record['wall'] += time.perf_counter() - start
+            if self.trace_memory:
+                peak = max(self._peaks.pop(),
+                           tracemalloc.get_traced_memory()[1])
+                record['peak_mem'] = max(record.get('peak_mem', 0), peak)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+
+    def timed(self, name, fn):
+        """Wrap fn so every call is recorded under phase `name`."""
+        record = self._record(name)
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record['calls'] += 1
+                record['wall'] += time.perf_counter() - start
+        wrapper.__name__ = getattr(fn, '__name__', name)
+        return wrapper
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def to_dict(self):
+        return {
+            'phases': self.phases,
+            'counts': self.counts,
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def enable(trace_memory=False):
+    """Start recording metrics, and return the profiler doing it."""
+    global _profiler
+    _profiler = Profiler(trace_memory=trace_memory)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def active():
+    return _profiler
+
+
+@contextmanager
+def phase(name):
+    if _profiler is None:
+        yield
+    else:
+        with _profiler.phase(name):
+            yield
+
+
+def count(name, n=1):
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def write_metrics(savedir, filename="metrics.json"):
+    """Write the recorded metrics to `savedir`, if profiling is enabled."""
+    if _profiler is None:
+        return None
+    path = f"{savedir}/{filename}"
+    with open(path, 'w') as f:
+        json.dump(_profiler.to_dict(), f, indent=2)
+    return path
@@ -0,0 +1,479 @@
+"""
+Declarative weighting and learning rules.
+
+A rule is an expression over whole-world quantities instead of a Python
+function of one community:
+
+    VAL           the community's value (hist[-1]) -- weighting rules
+    INPUT         the weighted input -- learning rules
+    SIZE          the community's size
+    neighbors(e)  the sum of e over the community's neighbors, each term
+                  times the link weight if weighted=True
+    numbers, + - * /, comparisons, where(), clip(), threshold() and the
+    elementwise transforms exp(), log(), sqrt() and absolute()
+
+For example, neighbor_size_dist_weighted_update is
+
+    hs = VAL * SIZE
+    Rule((hs + neighbors(hs, weighted=True))
+         / (SIZE + neighbors(SIZE, weighted=True)))
+
+A Rule can be passed to run_sim as weighting or learning on every backend.
+On the object backend it is called like any other rule, with comm (and the
+input value for learning rules) and interpreted community by community. On
+the array and parallel backends vecsim compiles it into batched sparse
+matrix and array operations, or with jit=True and numba installed into a
+compiled loop over the CSR rows. check_rule() compares the two on a world.
+"""
+
+import logging
+import operator
+from functools import partial
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Expr:
+    """A node of a rule expression."""
+
+    def __add__(self, other):
+        return BinOp("+", self, other)
+
+    def __radd__(self, other):
+        return BinOp("+", other, self)
+
+    def __sub__(self, other):
+        return BinOp("-", self, other)
+
+    def __rsub__(self, other):
+        return BinOp("-", other, self)
+
+    def __mul__(self, other):
+        return BinOp("*", self, other)
+
+    def __rmul__(self, other):
+        return BinOp("*", other, self)
+
+    def __truediv__(self, other):
+        return BinOp("/", self, other)
+
+    def __rtruediv__(self, other):
+        return BinOp("/", other, self)
+
+    def __neg__(self):
+        return BinOp("-", 0.0, self)
+
+    def __gt__(self, other):
+        return BinOp(">", self, other)
+
+    def __lt__(self, other):
+        return BinOp("<", self, other)
+
+    def __ge__(self, other):
+        return BinOp(">=", self, other)
+
+    def __le__(self, other):
+        return BinOp("<=", self, other)
+
+    def children(self):
+        return ()
+
+
+class Leaf(Expr):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+    def __reduce__(self):
+        # unpickle as the module's own VAL, INPUT or SIZE, which the
+        # evaluators recognise by identity
+        return self.name
+
+
+class Const(Expr):
+    def __init__(self, value):
+        self.value = float(value)
+
+    def __repr__(self):
+        return repr(self.value)
+
+
+def expr(x):
+    """Wrap a number as a Const; expressions are returned as they are."""
+    if isinstance(x, Expr):
+        return x
+    if isinstance(x, (int, float, np.number)):
+        return Const(x)
+    raise ValueError(f"Not a rule expression: {x!r}")
+
+
+BINOPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+}
+
+
+class BinOp(Expr):
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = expr(left)
+        self.right = expr(right)
+
+    def children(self):
+        return (self.left, self.right)
+
+    def __repr__(self):
+        return f"({self.left!r} {self.op} {self.right!r})"
+
+
+FUNCS = {"exp": np.exp, "log": np.log, "sqrt": np.sqrt, "abs": np.abs}
+
+
+class Func(Expr):
+    def __init__(self, name, arg):
+        self.name = name
+        self.arg = expr(arg)
+
+    def children(self):
+        return (self.arg,)
+
+    def __repr__(self):
+        return f"{self.name}({self.arg!r})"
+
+
+class Where(Expr):
+    def __init__(self, cond, then, otherwise):
+        self.cond = expr(cond)
+        self.then = expr(then)
+        self.otherwise = expr(otherwise)
+
+    def children(self):
+        return (self.cond, self.then, self.otherwise)
+
+    def __repr__(self):
+        return f"where({self.cond!r}, {self.then!r}, {self.otherwise!r})"
+
+
+class NeighborSum(Expr):
+    def __init__(self, term, weighted=False):
+        self.term = expr(term)
+        self.weighted = weighted
+
+    def children(self):
+        return (self.term,)
+
+    def __repr__(self):
+        return f"neighbors({self.term!r}, weighted={self.weighted})"
+
+
+VAL = Leaf("VAL")
+INPUT = Leaf("INPUT")
+SIZE = Leaf("SIZE")
+
+
+def neighbors(term, weighted=False):
+    return NeighborSum(term, weighted)
+
+
+def where(cond, then, otherwise):
+    return Where(cond, then, otherwise)
+
+
+def clip(x, lo, hi):
+    x = expr(x)
+    return where(x < lo, lo, where(x > hi, hi, x))
+
+
+def threshold(x, cutoff=0.5):
+    """1 above cutoff, 0 below it, unchanged at it (like clamp)."""
+    x = expr(x)
+    return where(x > cutoff, 1.0, where(x < cutoff, 0.0, x))
+
+
+def exp(x):
+    return Func("exp", x)
+
+
+def log(x):
+    return Func("log", x)
+
+
+def sqrt(x):
+    return Func("sqrt", x)
+
+
+def absolute(x):
+    return Func("abs", x)
+
+
+def walk(node):
+    yield node
+    for child in node.children():
+        yield from walk(child)
+
+
+class Rule:
+    """
+    A weighting rule (an expression of VAL) or a learning rule (an
+    expression of INPUT), callable like the per-community rules.
+    """
+
+    def __init__(self, body, name=None, jit=False):
+        self.body = expr(body)
+        leaves = {node for node in walk(self.body) if isinstance(node, Leaf)}
+        if VAL in leaves and INPUT in leaves:
+            raise ValueError("A rule can use VAL or INPUT, but not both.")
+        for node in walk(self.body):
+            if isinstance(node, NeighborSum) and any(
+                    leaf is INPUT for leaf in walk(node.term)):
+                raise ValueError("INPUT is only known for the community "
+                                 "itself, not its neighbors.")
+        self.learning = INPUT in leaves
+        self.__name__ = name or "rule"
+        self.jit = jit
+
+    def __repr__(self):
+        return f"Rule({self.body!r}, name={self.__name__!r})"
+
+    def __call__(self, comm, val=None):
+        return interpret(self.body, comm, val)
+
+    def compile(self):
+        """The array kernel, called as kernel(cw, h) or kernel(cw, val)."""
+        if self.jit:
+            try:
+                import numba
+            except ImportError:
+                logger.warning(f"numba is not installed; running rule "
+                               f"'{self.__name__}' with NumPy instead.")
+            else:
+                return partial(_run_loop_kernel,
+                               numba.njit(loop_kernel(self.body)), self.body)
+        return partial(_run_array_kernel, self.body)
+
+
+#
+# the built-in rules of lingnetsim, as declarative rules
+#
+
+def neighbor_weighted_rule(n_infl=0.10):
+    return Rule((VAL + n_infl * neighbors(VAL))
+                / (1 + n_infl * neighbors(1.0)),
+                name="neighbor_weighted_update")
+
+
+def neighbor_size_weighted_rule(n_infl=0.10):
+    hs = VAL * SIZE
+    return Rule((hs + n_infl * neighbors(hs))
+                / (SIZE + n_infl * neighbors(SIZE)),
+                name="neighbor_size_weighted_update")
+
+
+def neighbor_size_dist_weighted_rule(n_infl=1):
+    hs = VAL * SIZE
+    return Rule((hs + n_infl * neighbors(hs, weighted=True))
+                / (SIZE + n_infl * neighbors(SIZE, weighted=True)),
+                name="neighbor_size_dist_weighted_update")
+
+
+def clamp_rule(cutoff=0.5):
+    return Rule(threshold(INPUT, cutoff), name="clamp")
+
+
+#
+# reference interpreter
+#
+
+def interpret(node, comm, val=None, value=None):
+    """
+    Evaluate an expression for one community. `value(comm)` gives the
+    value VAL stands for, hist[-1] by default.
+    """
+    if value is None:
+        value = _last_value
+    if node is VAL:
+        return value(comm)
+    if node is INPUT:
+        return val
+    if node is SIZE:
+        return comm.size
+    if isinstance(node, Const):
+        return node.value
+    if isinstance(node, BinOp):
+        return BINOPS[node.op](interpret(node.left, comm, val, value),
+                               interpret(node.right, comm, val, value))
+    if isinstance(node, Func):
+        return FUNCS[node.name](interpret(node.arg, comm, val, value))
+    if isinstance(node, Where):
+        cond = interpret(node.cond, comm, val, value)
+        then = interpret(node.then, comm, val, value)
+        otherwise = interpret(node.otherwise, comm, val, value)
+        if np.ndim(cond):
+            return np.where(cond, then, otherwise)
+        return then if cond else otherwise
+    if isinstance(node, NeighborSum):
+        if node.weighted:
+            return sum(interpret(node.term, n, val, value) * wt
+                       for n, wt in comm.neighbors.items())
+        return sum(interpret(node.term, n, val, value)
+                   for n in comm.neighbors)
+    raise ValueError(f"No such rule expression: {node!r}")
+
+
+def _last_value(comm):
+    return comm.hist[-1]
+
+
+#
+# array compilation
+#
+
+def evaluate(node, cw, x):
+    """
+    Evaluate an expression for all communities of a CompiledWorld, with x
+    the values VAL or INPUT stand for, one row per community.
+    """
+    if node is VAL or node is INPUT:
+        return x
+    if node is SIZE:
+        return cw.size
+    if isinstance(node, Const):
+        return node.value
+    if isinstance(node, BinOp):
+        left, right = _align(evaluate(node.left, cw, x),
+                             evaluate(node.right, cw, x))
+        return BINOPS[node.op](left, right)
+    if isinstance(node, Func):
+        return FUNCS[node.name](evaluate(node.arg, cw, x))
+    if isinstance(node, Where):
+        cond, then, otherwise = _align(evaluate(node.cond, cw, x),
+                                       evaluate(node.then, cw, x),
+                                       evaluate(node.otherwise, cw, x))
+        return np.where(cond, then, otherwise)
+    if isinstance(node, NeighborSum):
+        term = evaluate(node.term, cw, x)
+        if np.ndim(term) == 0:
+            term = np.full(cw.n, term)
+        matrix = cw.weights if node.weighted else cw.adjacency
+        return matrix @ term
+    raise ValueError(f"No such rule expression: {node!r}")
+
+
+def _align(*arrays):
+    """
+    Let per-community vectors broadcast against values with one column per
+    replicate or feature.
+    """
+    if any(np.ndim(a) == 2 for a in arrays):
+        return [a[:, None] if np.ndim(a) == 1 else a for a in arrays]
+    return arrays
+
+
+def _run_array_kernel(body, cw, x):
+    out = np.asarray(evaluate(body, cw, x), dtype=float)
+    if out.shape == x.shape:
+        return out
+    # rules that do not depend on VAL or INPUT give one value per community
+    # (or one in all)
+    if out.ndim == 1 and x.ndim == 2:
+        out = out[:, None]
+    return np.broadcast_to(out, x.shape).copy()
+
+
+def loop_kernel(body):
+    """
+    Generate a plain Python function computing the rule community by
+    community over the CSR arrays, in the same order of operations as the
+    interpreter, for numba to compile:
+
+        kernel(indptr, indices, weights, size, x, out)
+    """
+    lines = []
+    counter = iter(range(1 << 30))
+
+    def emit(node, i, indent):
+        if node is VAL or node is INPUT:
+            return f"x[{i}]"
+        if node is SIZE:
+            return f"size[{i}]"
+        if isinstance(node, Const):
+            return repr(node.value)
+        if isinstance(node, BinOp):
+            left = emit(node.left, i, indent)
+            right = emit(node.right, i, indent)
+            return f"({left} {node.op} {right})"
+        if isinstance(node, Func):
+            return f"np.{node.name}({emit(node.arg, i, indent)})"
+        if isinstance(node, Where):
+            k = next(counter)
+            cond = emit(node.cond, i, indent)
+            then = emit(node.then, i, indent)
+            otherwise = emit(node.otherwise, i, indent)
+            lines.append(f"{indent}w{k} = {then} if {cond} else {otherwise}")
+            return f"w{k}"
+        if isinstance(node, NeighborSum):
+            k = next(counter)
+            lines.append(f"{indent}s{k} = 0.0")
+            lines.append(f"{indent}for e{k} in range(indptr[{i}], "
+                         f"indptr[{i} + 1]):")
+            inner = indent + "    "
+            lines.append(f"{inner}j{k} = indices[e{k}]")
+            term = emit(node.term, f"j{k}", inner)
+            if node.weighted:
+                term = f"{term} * weights[e{k}]"
+            lines.append(f"{inner}s{k} += {term}")
+            return f"s{k}"
+        raise ValueError(f"No such rule expression: {node!r}")
+
+    result = emit(body, "i", "        ")
+    source = "\n".join(
+        ["def kernel(indptr, indices, weights, size, x, out):",
+         "    for i in range(len(out)):"]
+        + lines
+        + [f"        out[i] = {result}"])
+    namespace = {"np": np}
+    exec(source, namespace)
+    return namespace["kernel"]
+
+
+def _run_loop_kernel(kernel, body, cw, x):
+    if x.ndim != 1:
+        return _run_array_kernel(body, cw, x)
+    weights = cw.weights
+    out = np.empty(cw.n)
+    kernel(weights.indptr, weights.indices, weights.data, cw.size,
+           np.ascontiguousarray(x, dtype=float), out)
+    return out
+
+
+def check_rule(rule, world, vals=None):
+    """
+    Evaluate a rule on the world both with the reference interpreter and
+    with the compiled array kernel, and return the largest difference.
+    Weighting rules take VAL from the communities' current val, learning
+    rules take INPUT from `vals` (the current vals by default).
+    """
+    from vecsim import CompiledWorld
+
+    if vals is None:
+        vals = [comm.val for comm in world]
+    x = np.array(vals, dtype=float)
+    if rule.learning:
+        expected = [rule(comm, val) for comm, val in zip(world, vals)]
+    else:
+        expected = [interpret(rule.body, comm, value=lambda c: c.val)
+                    for comm in world]
+    actual = rule.compile()(CompiledWorld(world), x)
+    if not len(x):
+        return 0.0
+    return float(np.max(np.abs(actual - np.array(expected, dtype=float))))
@@ -0,0 +1,74 @@
+"""
+Uniform grid index for finding communities within a distance of each other.
+"""
+
+from math import sqrt
+
+
+class GridIndex:
+    def __init__(self, world, cellsize):
+        self.world = world
+        self.cellsize = cellsize
+        self.cells = {}
+        for i, comm in enumerate(world):
+            self.cells.setdefault(self.cell_of(comm), []).append(i)
+
+    def cell_of(self, comm):
+        return (int(comm.x // self.cellsize), int(comm.y // self.cellsize))
+
+    def candidates(self, i, radius):
+        """
+        Indices j > i of all communities that may lie within `radius` of
+        world[i], in ascending order.
+        """
+        cx, cy = self.cell_of(self.world[i])
+        reach = int(-(-radius // self.cellsize))
+        found = []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                for j in self.cells.get((cx + dx, cy + dy), ()):
+                    if j > i:
+                        found.append(j)
+        found.sort()
+        return found
+
+    def pairs_within(self, radius, sources=None):
+        """
+        Yield (i, j, dist) for every pair i < j closer than `radius`, in the
+        same order as a nested loop over the world would visit them.
+
+        If `sources` is given, only pairs whose first member is in it are
+        considered.
+        """
+        world = self.world
+        if sources is None:
+            sources = range(len(world))
+        for i in sources:
+            comm1 = world[i]
+            for j in self.candidates(i, radius):
+                comm2 = world[j]
+                dist = sqrt((comm1.x - comm2.x) ** 2
+                            + (comm1.y - comm2.y) ** 2)
+                if dist < radius:
+                    yield i, j, dist
+
+
+def candidate_pairs(world, radius):
+    """
+    All pairs of communities closer than `radius`, as arrays (i, j, dist)
+    with i < j, sorted by i and then j (the order a nested loop over the
+    world would visit them in).
+    """
+    import numpy as np
+    from scipy.spatial import cKDTree
+
+    x = np.array([comm.x for comm in world], dtype=float)
+    y = np.array([comm.y for comm in world], dtype=float)
+    pairs = cKDTree(np.column_stack([x, y])).query_pairs(
+        radius, output_type='ndarray')
+    i, j = pairs[:, 0], pairs[:, 1]
+    order = np.lexsort((j, i))
+    i, j = i[order], j[order]
+    dist = np.sqrt((x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2)
+    keep = dist < radius
+    return i[keep], j[keep], dist[keep]
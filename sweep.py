@@ -0,0 +1,139 @@
+"""
+Parameter sweeps over seeds and simulation configurations.
+
+A sweep runs the usual gen_world -> init_sim -> run_sim pipeline for every
+combination in a config grid, fanned out over a process pool. Each task
+generates its world from its own seed, so that tasks sharing a world
+configuration can load it from a WorldCache, and spawns independent random
+streams for initialization and the simulation from the same seed. Results
+therefore do not depend on how tasks are scheduled or how many workers run
+them. Each task writes a small .npz of summary arrays, and tasks whose
+results already exist are skipped on rerun.
+"""
+
+import hashlib
+import itertools
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'size': 50,
+    'density': 4,
+    'commclass': "community:Community",
+    'init': "single_locus_unchanging_city",
+    'weighting': "neighbor_size_dist_weighted_update",
+    'learning': "copy_input",
+    'n_infl': None,
+    'cutoff': None,
+    'rounds': 50,
+    'randomize': False,
+    'backend': "object",
+}
+
+
+def grid(seeds=(0,), **params):
+    """
+    Expand lists of parameter values into the list of task configs for
+    their cartesian product with `seeds`. Parameters not given keep their
+    value from DEFAULTS; scalars are treated as one-element lists.
+    """
+    params = {**DEFAULTS, **params}
+    names = list(params)
+    values = [v if isinstance(v, (list, tuple)) else [v]
+              for v in params.values()]
+    return [dict(zip(names, combo), seed=seed)
+            for combo in itertools.product(*values)
+            for seed in seeds]
+
+
+def task_id(config):
+    blob = json.dumps(config, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+def run_task(config, cache=None):
+    """
+    Run one task and return its summary arrays. Its world is loaded from
+    the WorldCache `cache` if one is given and holds it.
+    """
+    import importlib
+    import lingnetsim as lns
+    from util import spawn_rngs
+
+    module, name = config['commclass'].split(":")
+    commclass = getattr(importlib.import_module(module), name)
+    weighting = getattr(lns, config['weighting'])
+    if config['n_infl'] is not None:
+        weighting = partial(weighting, n_infl=config['n_infl'])
+    learning = getattr(lns, config['learning'])
+    if config['cutoff'] is not None:
+        learning = partial(learning, cutoff=config['cutoff'])
+
+    init_rng, sim_rng = spawn_rngs(config['seed'], 2)
+    world = lns.gen_world(size=config['size'], density=config['density'],
+                          seed=config['seed'], commclass=commclass,
+                          cache=cache)
+    lns.init_sim(world, method=getattr(lns, config['init']), rng=init_rng)
+    lns.run_sim(world, config['rounds'], weighting=weighting,
+                learning=learning, randomize=config['randomize'],
+                backend=config['backend'], rng=sim_rng)
+
+    hist = np.array([comm.hist for comm in world], dtype=float).T
+    return {
+        'avg': hist.mean(axis=1),
+        'std': hist.std(axis=1),
+        'final': np.array([comm.val for comm in world]),
+        'x': np.array([comm.x for comm in world], dtype=np.int32),
+        'y': np.array([comm.y for comm in world], dtype=np.int32),
+        'size': np.array([comm.size for comm in world], dtype=np.int8),
+    }
+
+
+def _run_and_save(config, path, cache):
+    summary = run_task(config, cache)
+    summary['config'] = np.array(json.dumps(config, sort_keys=True))
+    tmppath = f"{path}.tmp"
+    with open(tmppath, 'wb') as f:
+        np.savez_compressed(f, **summary)
+    os.replace(tmppath, path)
+    return path
+
+
+def run_sweep(configs, outdir="results-sweep", workers=None, cache=None):
+    """
+    Run every config not already finished in `outdir` on a pool of
+    `workers` processes, and return the result paths in config order.
+    Tasks load and store their worlds in the WorldCache `cache`, if given.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    paths = [os.path.join(outdir, f"{task_id(config)}.npz")
+             for config in configs]
+    todo = [(config, path) for config, path in zip(configs, paths)
+            if not os.path.exists(path)]
+    logger.info(f"Running sweep of {len(configs)} tasks "
+                f"({len(configs) - len(todo)} already done).")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_run_and_save, config, path, cache): config
+                   for config, path in todo}
+        for i, future in enumerate(as_completed(futures)):
+            future.result()
+            logger.info(f"Finished task {i + 1}/{len(todo)}.")
+    return paths
+
+
+def load_results(paths):
+    """Load sweep results as a list of (config, summary) pairs."""
+    results = []
+    for path in paths:
+        with np.load(path) as arrays:
+            summary = {k: arrays[k] for k in arrays.files if k != 'config'}
+            results.append((json.loads(str(arrays['config'])), summary))
+    return results
@@ -1,10 +1,69 @@
 import random
 
+import numpy as np
 
-def random_jitter(val, jitter=0.01):
-    newval = val + jitter * random.uniform(-1, 1)
+
+def random_jitter(val, jitter=0.01, noise=None):
+    # noise in [-1, 1] may be given, e.g. drawn in bulk by jitter_noise();
+    # otherwise it is drawn from the global random module
+    if noise is None:
+        noise = random.uniform(-1, 1)
+    newval = val + jitter * noise
     if newval > 1.0:
         newval = 1.0
     elif newval < 0.0:
         newval = 0.0
     return newval
+
+
+def make_rng(rng=None):
+    """
+    A NumPy Generator from a seed (int or SeedSequence), None for fresh
+    entropy, or a saved bit_generator.state (as in a checkpoint) to resume
+    from; a Generator is returned as it is.
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if isinstance(rng, dict):
+        bit_generator = getattr(np.random, rng['bit_generator'])()
+        bit_generator.state = rng
+        return np.random.Generator(bit_generator)
+    return np.random.default_rng(rng)
+
+
+def spawn_rngs(rng, n):
+    """
+    `n` independent Generators spawned from a seed or Generator, e.g. one
+    per run of a batch. The same seed always gives the same streams.
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng.spawn(n)
+    return [np.random.default_rng(s)
+            for s in np.random.SeedSequence(rng).spawn(n)]
+
+
+def jitter_noise(shape, rng=None):
+    """
+    Uniform noise in [-1, 1] for a whole round of jitter in one call. With
+    no rng the values are drawn one by one from the global random module,
+    the same draws in the same order as that many random_jitter calls.
+    """
+    if rng is None:
+        n = int(np.prod(shape))
+        return np.array([random.uniform(-1, 1) for _ in range(n)]).reshape(
+            shape)
+    return rng.uniform(-1, 1, shape)
+
+
+def choice(seq, rng=None):
+    """random.choice, or an index drawn from `rng` if one is given."""
+    if rng is None:
+        return random.choice(seq)
+    return seq[int(rng.integers(len(seq)))]
+
+
+def choices(seq, k, rng=None):
+    """random.choices with replacement, or drawn from `rng` if given."""
+    if rng is None:
+        return random.choices(seq, k=k)
+    return [seq[i] for i in rng.integers(len(seq), size=k).tolist()]
@@ -0,0 +1,445 @@
+"""
+Array-based simulation engine.
+
+The world is compiled into sparse (CSR) neighbor matrices and NumPy state
+vectors, and the weighting and learning functions from lingnetsim are run
+as batched matrix-vector steps over all communities at once.
+"""
+
+import inspect
+import os
+import sys
+from functools import partial
+
+import numpy as np
+from scipy import sparse
+
+from community import Community
+from lowbackmerger import GenerationalCommunity, NUM_GENERATIONS
+from profiling import phase
+from rules import Rule
+from util import jitter_noise, spawn_rngs
+from world import World
+
+
+LINGNETSIM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               "lingnetsim.py")
+
+
+def _rule_name(fn):
+    """
+    The name of a rule defined in lingnetsim (also when it runs as the main
+    script), which is what the kernels are registered under. Any other
+    function gets its qualified name, which matches no kernel, so that a
+    user's rule is never mistaken for a built-in one of the same name.
+    """
+    module = getattr(fn, '__module__', None)
+    name = getattr(fn, '__qualname__', repr(fn))
+    if module == "lingnetsim":
+        if getattr(sys.modules["lingnetsim"], name, None) is fn:
+            return name
+    elif module == "__main__":
+        code = getattr(fn, '__code__', None)
+        if code is not None and \
+                os.path.abspath(code.co_filename) == LINGNETSIM_PATH:
+            return name
+    return f"{module}.{name}"
+
+
+def _unwrap(fn):
+    """
+    Resolve a (possibly partial) per-community rule into its name (see
+    _rule_name) and the full set of keyword arguments it would be called
+    with.
+    """
+    args, kwargs = (), {}
+    while isinstance(fn, partial):
+        args = fn.args + args
+        kwargs = {**fn.keywords, **kwargs}
+        fn = fn.func
+    bound = inspect.signature(fn).bind_partial(None, *args, **kwargs)
+    bound.apply_defaults()
+    params = dict(bound.arguments)
+    params.pop(next(iter(params)))
+    return _rule_name(fn), params
+
+
+class CompiledWorld:
+    def __init__(self, world):
+        self.world = world
+        self._two_hop = None
+        if isinstance(world, World):
+            self._from_arrays(world)
+            return
+        index = {comm: i for i, comm in enumerate(world)}
+        indptr = [0]
+        indices = []
+        weights = []
+        for comm in world:
+            for other, wt in comm.neighbors.items():
+                indices.append(index[other])
+                weights.append(wt)
+            indptr.append(len(indices))
+        n = len(world)
+        self.n = n
+        self.weights = sparse.csr_matrix(
+            (np.array(weights, dtype=float), np.array(indices, dtype=np.int64),
+             np.array(indptr, dtype=np.int64)), shape=(n, n))
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(len(indices)), self.weights.indices, self.weights.indptr),
+            shape=(n, n))
+        self.degree = np.diff(self.weights.indptr).astype(float)
+        self.size = np.array([comm.size for comm in world], dtype=float)
+        self.rate = np.array([comm.rate_of_change for comm in world],
+                             dtype=float)
+
+    @property
+    def two_hop(self):
+        """Second-degree neighbor matrix, see two_hop()."""
+        if self._two_hop is None:
+            self._two_hop = two_hop(self.adjacency)
+        return self._two_hop
+
+    def _from_arrays(self, world):
+        n = len(world)
+        self.n = n
+        self.weights = sparse.csr_matrix(
+            (world.weights, world.indices, world.indptr), shape=(n, n))
+        self.adjacency = sparse.csr_matrix(
+            (np.ones(world.nedges), self.weights.indices,
+             self.weights.indptr), shape=(n, n))
+        self.degree = world.degree.astype(float)
+        self.size = world.size.astype(float)
+        self.rate = world.rate.copy()
+
+
+def two_hop(adjacency):
+    """
+    Sparse 0/1 matrix of second-degree neighbors: communities two links
+    away that are neither neighbors nor the community itself.
+    """
+    n = adjacency.shape[0]
+    a = sparse.csr_matrix(adjacency, dtype=bool)
+    paths = (a @ a).tocoo()
+    keep = paths.row != paths.col
+    reach = sparse.csr_matrix(
+        (np.ones(np.count_nonzero(keep)), (paths.row[keep], paths.col[keep])),
+        shape=(n, n))
+    reach = reach - reach.multiply(a)
+    reach.eliminate_zeros()
+    reach.sort_indices()
+    return reach
+
+
+def per_comm(vec, like):
+    """Shape a per-community vector to broadcast against `like`, which may
+    hold one column per replicate or feature."""
+    return vec if like.ndim == 1 else vec[:, None]
+
+
+#
+# weighting kernels
+#
+
+def neighbor_weighted_update(cw, h, n_infl=0.10):
+    return ((h + n_infl * (cw.adjacency @ h))
+            / per_comm(1 + n_infl * cw.degree, h))
+
+
+def neighbor_size_weighted_update(cw, h, n_infl=0.10):
+    hs = h * per_comm(cw.size, h)
+    return ((hs + n_infl * (cw.adjacency @ hs))
+            / per_comm(cw.size + n_infl * (cw.adjacency @ cw.size), h))
+
+
+def neighbor_size_dist_weighted_update(cw, h, n_infl=1):
+    hs = h * per_comm(cw.size, h)
+    return ((hs + n_infl * (cw.weights @ hs))
+            / per_comm(cw.size + n_infl * (cw.weights @ cw.size), h))
+
+
+#
+# learning kernels
+#
+
+def copy_input(cw, val):
+    return val
+
+
+def clamp(cw, val, cutoff=0.5):
+    return np.where(val > cutoff, 1.0, np.where(val < cutoff, 0.0, val))
+
+
+WEIGHTING_KERNELS = {fn.__name__: fn for fn in (
+    neighbor_weighted_update,
+    neighbor_size_weighted_update,
+    neighbor_size_dist_weighted_update)}
+
+LEARNING_KERNELS = {fn.__name__: fn for fn in (copy_input, clamp)}
+
+
+def compile_rule(fn, kernels):
+    """
+    Look up the array kernel for a per-community rule, binding any
+    arguments given through functools.partial. Declarative rules (see
+    rules.py) are compiled from their expression.
+    """
+    if isinstance(fn, Rule):
+        return fn.compile()
+    name, params = _unwrap(fn)
+    if name not in kernels:
+        raise ValueError(f"No array kernel for '{name}'; "
+                         f"use backend='object' instead.")
+    return partial(kernels[name], **params)
+
+
+def random_jitter(vals, amt, rng=None):
+    noise = jitter_noise(vals.shape, rng)
+    return np.clip(vals + amt * noise, 0.0, 1.0)
+
+
+class ValueState:
+    """Array state of a world of Community objects."""
+
+    def __init__(self, world):
+        if isinstance(world, World):
+            self.val = world.val.copy()
+        else:
+            self.val = np.array([comm.val for comm in world], dtype=float)
+
+    def new_generation(self):
+        pass
+
+    def jitter(self, amt, rng=None):
+        self.val = random_jitter(self.val, amt, rng)
+
+    def update(self, newvals, rate):
+        self.val = self.val + rate * (newvals - self.val)
+
+    def write_back(self, world):
+        if isinstance(world, World):
+            world.val[:] = self.val
+            return
+        vals = self.val.tolist() if self.val.ndim == 1 else list(self.val)
+        for comm, val in zip(world, vals):
+            comm.val = val
+
+
+class GenerationalState:
+    """
+    Array state of a world of GenerationalCommunity objects: a
+    (communities x NUM_GENERATIONS) circular buffer of adult cohorts shared
+    by all communities, plus the children's values.
+    """
+
+    def __init__(self, world):
+        self.adults = np.array([comm.adult_vals for comm in world],
+                               dtype=float)
+        self.head = 0
+        self.children = np.array([comm.children_val for comm in world],
+                                 dtype=float)
+        self.val = self.mean()
+
+    def order(self):
+        """Buffer columns from oldest to newest cohort."""
+        return (self.head + np.arange(NUM_GENERATIONS)) % NUM_GENERATIONS
+
+    def mean(self):
+        # summed oldest cohort first, the order write_back leaves the
+        # buffer in, so that a run split into chunks adds up the same
+        return self.adults[:, self.order()].mean(axis=1)
+
+    def new_generation(self):
+        self.adults[:, self.head] = self.children
+        self.head = (self.head + 1) % NUM_GENERATIONS
+        self.val = self.mean()
+
+    def jitter(self, amt, rng=None):
+        # community by community, oldest cohort first, like
+        # GenerationalCommunity.jitter
+        cols = self.order()
+        noise = jitter_noise(self.adults.shape, rng)
+        self.adults[:, cols] = np.clip(self.adults[:, cols] + amt * noise,
+                                       0.0, 1.0)
+        self.val = self.mean()
+
+    def update(self, newvals, rate):
+        self.children = self.val + rate * (newvals - self.val)
+
+    def write_back(self, world):
+        adults = self.adults[:, self.order()].tolist()
+        for comm, adult_vals, children_val in zip(
+                world, adults, self.children.tolist()):
+            comm.adult_vals = adult_vals
+            comm.children_val = children_val
+
+
+def world_state(world):
+    if isinstance(world, World):
+        return ValueState(world)
+    if len(world) and np.ndim(world[0].val) and \
+            isinstance(world[0], GenerationalCommunity):
+        raise ValueError("Feature vectors are not supported for "
+                         "GenerationalCommunity worlds.")
+    if all(isinstance(comm, GenerationalCommunity) for comm in world):
+        return GenerationalState(world)
+    elif all(isinstance(comm, Community) for comm in world):
+        return ValueState(world)
+    raise ValueError("The array backend only supports worlds of Community "
+                     "or GenerationalCommunity objects.")
+
+
+def run_sim(world, rounds, weighting, learning, randomize=False, history=None,
+            converge=None, rng=None):
+    """
+    Run up to `rounds` rounds on the arrays compiled from the world and
+    write the final state and history back. Returns the number of rounds
+    run, which is less than `rounds` if `converge` stopped the run early.
+    Jitter is drawn from the Generator `rng`, or from the global random
+    module if it is None.
+    """
+    with phase("run_sim.compile"):
+        cw = CompiledWorld(world)
+    state = world_state(world)
+    weight_fn = compile_rule(weighting, WEIGHTING_KERNELS)
+    learn_fn = compile_rule(learning, LEARNING_KERNELS)
+
+    hist = np.empty((rounds,) + state.val.shape) if history is None else None
+    done = rounds
+    for i in range(rounds):
+        h = state.val
+        if history is None:
+            hist[i] = h
+        else:
+            history.append_row(h)
+        with phase("run_sim.new_generation"):
+            state.new_generation()
+        if randomize:
+            with phase("run_sim.jitter"):
+                state.jitter(0.05, rng)
+        with phase("run_sim.weighting"):
+            weighted = weight_fn(cw, h)
+        with phase("run_sim.learning"):
+            newvals = learn_fn(cw, weighted)
+        with phase("run_sim.update"):
+            state.update(newvals, cw.rate)
+        if converge is not None and converge.check(h, state.val):
+            done = i + 1
+            break
+
+    state.write_back(world)
+    if history is None:
+        extend_hist(world, hist[:done])
+    return done
+
+
+def extend_hist(world, hist):
+    """Append a (rounds x communities) block to the communities' hist lists."""
+    for k, comm in enumerate(world):
+        column = hist[:, k]
+        comm.hist.extend(column.tolist() if column.ndim == 1 else column)
+
+
+def run_ensemble(world, rounds, replicates, weighting, learning, jitter=0.05,
+                 seed=None, quantiles=(0.05, 0.5, 0.95)):
+    """
+    Run `replicates` randomized simulations of the world at once, as one
+    (communities x replicates) state matrix, starting from the current
+    values. Each replicate draws its jitter from its own independent stream
+    spawned from `seed`. The world itself is left unchanged.
+
+    Returns a dict of trajectories over the values recorded at the start of
+    each round, like hist: 'mean' and 'var' (rounds x communities) across
+    replicates, 'quantiles' (rounds x len(quantiles) x communities) and
+    'avg' (rounds x replicates), the world average in each replicate.
+    """
+    if not all(isinstance(comm, Community) for comm in world):
+        raise ValueError("The array backend only supports Community worlds.")
+
+    cw = CompiledWorld(world)
+    weight_fn = compile_rule(weighting, WEIGHTING_KERNELS)
+    learn_fn = compile_rule(learning, LEARNING_KERNELS)
+    rngs = spawn_rngs(seed, replicates)
+    rate = cw.rate[:, None]
+
+    vals = np.repeat(np.array([comm.val for comm in world], dtype=float)
+                     [:, None], replicates, axis=1)
+    mean = np.empty((rounds, cw.n))
+    var = np.empty((rounds, cw.n))
+    quant = np.empty((rounds, len(quantiles), cw.n))
+    avg = np.empty((rounds, replicates))
+    for i in range(rounds):
+        h = vals
+        mean[i] = h.mean(axis=1)
+        var[i] = h.var(axis=1)
+        quant[i] = np.quantile(h, quantiles, axis=1)
+        avg[i] = h.mean(axis=0)
+        if jitter:
+            noise = np.stack([rng.uniform(-1, 1, cw.n) for rng in rngs],
+                             axis=1)
+            vals = np.clip(vals + jitter * noise, 0.0, 1.0)
+        newvals = learn_fn(cw, weight_fn(cw, h))
+        vals = vals + rate * (newvals - vals)
+
+    return {'mean': mean, 'var': var, 'quantiles': quant, 'avg': avg}
+
+
+def solve_steady_state(world, weighting, apply=False):
+    """
+    Solve directly for the values a run with `learning=copy_input` and no
+    jitter converges to, instead of simulating until it does.
+
+    Every weighting rule is a row-stochastic averaging x -> P x, so
+    communities with rate_of_change 0 keep their values and every other
+    community in a connected component with at least one of them ends up at
+    the solution of the sparse system (I - P) x = 0 on those communities.
+    A component without any such community settles on a consensus
+    value, the average of its current values weighted by the stationary
+    distribution of the Community update. (GenerationalCommunity worlds
+    average over cohorts, and only approximately conserve that average.)
+
+    If `apply` is set, the steady state is written back to the world.
+    Returns the vector of steady-state values.
+    """
+    from scipy.sparse.csgraph import connected_components
+    from scipy.sparse.linalg import spsolve
+
+    cw = CompiledWorld(world)
+    name, params = _unwrap(weighting)
+    if name == "neighbor_weighted_update":
+        c, neigh = np.ones(cw.n), cw.adjacency
+    elif name == "neighbor_size_weighted_update":
+        c, neigh = cw.size, cw.adjacency
+    elif name == "neighbor_size_dist_weighted_update":
+        c, neigh = cw.size, cw.weights
+    else:
+        raise ValueError(f"No steady-state solver for '{name}'.")
+    n_infl = params['n_infl']
+
+    d = c + n_infl * (neigh @ c)
+    step = sparse.diags(1 / d) @ (sparse.diags(c)
+                                  + n_infl * neigh @ sparse.diags(c))
+    laplacian = (sparse.identity(cw.n) - step).tocsr()
+
+    x0 = world_state(world).val
+    vals = x0.copy()
+    pinned = cw.rate == 0
+    _, labels = connected_components(cw.adjacency, directed=False)
+    has_pin = np.bincount(labels, weights=pinned) > 0
+
+    free = ~pinned & has_pin[labels]
+    if free.any():
+        rhs = -(laplacian[free][:, pinned] @ x0[pinned])
+        vals[free] = spsolve(laplacian[free][:, free].tocsc(), rhs)
+
+    floating = ~has_pin[labels]
+    if floating.any():
+        pi = np.where(floating, c * d / np.where(pinned, 1, cw.rate), 0)
+        consensus = (np.bincount(labels, weights=pi * x0)
+                     / np.maximum(np.bincount(labels, weights=pi), 1e-300))
+        vals[floating] = consensus[labels[floating]]
+
+    if apply:
+        for comm, val in zip(world, vals.tolist()):
+            comm.val = val
+    return vals
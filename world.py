@@ -0,0 +1,322 @@
+"""
+Column-oriented storage for large worlds.
+
+A World keeps the attributes of all its communities in NumPy arrays and
+the neighbor relation in CSR arrays, instead of one Python object (with a
+__dict__, a neighbors dict and a hist list) per community. Indexing or
+iterating over it gives CommunityView objects. A view has the attributes
+and methods of a Community but reads and writes the arrays, so the init
+functions, weighting and learning functions and plot_* functions work on
+a World just as on a list of Community objects. Views are cached, so the
+same community is always the same object and `is` and dict lookups work.
+
+Edges added with add_neighbor or add_edges are collected and merged into
+the CSR arrays the next time the adjacency is read.
+"""
+
+import numpy as np
+
+from community import COMM_SIZES, DIST_THRESHOLDS, Community
+
+TYPES = ("village", "town", "city")
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+SIZES = np.array([COMM_SIZES[name] for name in TYPES], dtype=np.int8)
+THRESHOLDS = np.array([[DIST_THRESHOLDS[(a, b)] for b in TYPES]
+                       for a in TYPES], dtype=float)
+
+
+class CommunityView:
+    """One community of a World, with the interface of a Community."""
+
+    __slots__ = ("world", "index")
+
+    def __init__(self, world, index):
+        self.world = world
+        self.index = index
+
+    def __repr__(self):
+        return f"<CommunityView {self.index} of {len(self.world)}>"
+
+    @property
+    def x(self):
+        return int(self.world.x[self.index])
+
+    @x.setter
+    def x(self, x):
+        self.world.x[self.index] = x
+
+    @property
+    def y(self):
+        return int(self.world.y[self.index])
+
+    @y.setter
+    def y(self, y):
+        self.world.y[self.index] = y
+
+    @property
+    def type(self):
+        return TYPES[self.world.type_code[self.index]]
+
+    @type.setter
+    def type(self, commtype):
+        self.world.set_type(self.index, commtype)
+
+    @property
+    def size(self):
+        return int(self.world.size[self.index])
+
+    @property
+    def val(self):
+        return float(self.world.val[self.index])
+
+    @val.setter
+    def val(self, val):
+        self.world.val[self.index] = val
+
+    @property
+    def rate_of_change(self):
+        return float(self.world.rate[self.index])
+
+    @rate_of_change.setter
+    def rate_of_change(self, rate):
+        self.world.rate[self.index] = rate
+
+    @property
+    def hist(self):
+        hists = self.world.hists
+        if hists[self.index] is None:
+            hists[self.index] = []
+        return hists[self.index]
+
+    @hist.setter
+    def hist(self, hist):
+        self.world.hists[self.index] = hist
+
+    @property
+    def neighbors(self):
+        """A new dict of neighbor views to weights; add_neighbor to change."""
+        world = self.world
+        indices, weights = world.neighbors_of(self.index)
+        return {world.view(j): wt
+                for j, wt in zip(indices.tolist(), weights.tolist())}
+
+    def add_neighbor(self, other, dist, thresholds=DIST_THRESHOLDS):
+        threshold = thresholds[(self.type, other.type)]
+        self.world.add_edge(self.index, other.index,
+                            (threshold - dist) / threshold)
+
+    @property
+    def ind_neighbors(self):
+        world = self.world
+        indptr, indices = world.two_hop()
+        row = indices[indptr[self.index]:indptr[self.index + 1]]
+        return [world.view(j) for j in row.tolist()]
+
+    to_dict = Community.to_dict
+    new_generation = Community.new_generation
+    update = Community.update
+    jitter = Community.jitter
+
+
+class World:
+    """
+    The communities of a world as arrays: x, y, type_code, size, val,
+    rate and the weighted adjacency in CSR form (indptr, indices,
+    weights), with each row's neighbors in the order they were added.
+    """
+
+    def __init__(self, x, y, types=None):
+        n = len(x)
+        self.x = np.array(x, dtype=np.int32)
+        self.y = np.array(y, dtype=np.int32)
+        if types is None:
+            self.type_code = np.zeros(n, dtype=np.int8)
+        else:
+            self.type_code = np.array([TYPE_CODES[t] for t in types],
+                                      dtype=np.int8)
+        self.size = SIZES[self.type_code]
+        self.val = np.zeros(n)
+        self.rate = np.ones(n)
+        self.hists = [None] * n
+        self._views = [None] * n
+        self._indptr = np.zeros(n + 1, dtype=np.int64)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._weights = np.zeros(0)
+        self._pending = []
+        self._pending_edges = ([], [], [])
+        self._two_hop = None
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.view(j) for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("World index out of range")
+        return self.view(i)
+
+    def __iter__(self):
+        return (self.view(i) for i in range(len(self)))
+
+    def view(self, i):
+        view = self._views[i]
+        if view is None:
+            view = self._views[i] = CommunityView(self, i)
+        return view
+
+    def set_type(self, i, commtype):
+        self.type_code[i] = TYPE_CODES[commtype]
+        self.size[i] = SIZES[self.type_code[i]]
+
+    @property
+    def types(self):
+        return [TYPES[code] for code in self.type_code.tolist()]
+
+    def add_edge(self, i, j, weight):
+        """Add (or reweight) the directed edge i -> j."""
+        src, dst, wts = self._pending_edges
+        src.append(i)
+        dst.append(j)
+        wts.append(weight)
+
+    def add_edges(self, src, dst, weights):
+        """Add directed edges src[k] -> dst[k] from arrays."""
+        self._stash_edges()
+        self._pending.append((np.asarray(src, dtype=np.int64),
+                              np.asarray(dst, dtype=np.int64),
+                              np.asarray(weights, dtype=float)))
+
+    def _stash_edges(self):
+        src, dst, wts = self._pending_edges
+        if src:
+            self._pending.append((np.array(src, dtype=np.int64),
+                                  np.array(dst, dtype=np.int64),
+                                  np.array(wts, dtype=float)))
+            self._pending_edges = ([], [], [])
+
+    def rebuild(self):
+        """Merge edges added since the last rebuild into the CSR arrays."""
+        self._stash_edges()
+        if not self._pending:
+            return
+        n = len(self)
+        rows = np.repeat(np.arange(n), np.diff(self._indptr))
+        src = np.concatenate([rows] + [p[0] for p in self._pending])
+        dst = np.concatenate([self._indices] + [p[1] for p in self._pending])
+        wts = np.concatenate([self._weights] + [p[2] for p in self._pending])
+        self._pending = []
+        self._two_hop = None
+
+        # an edge added twice keeps its first position and its last weight,
+        # as with a neighbors dict
+        key = src * n + dst
+        _, first, inverse = np.unique(key, return_index=True,
+                                      return_inverse=True)
+        if len(first) < len(key):
+            last = np.zeros(len(first), dtype=np.int64)
+            np.maximum.at(last, inverse, np.arange(len(key)))
+            keep = np.sort(first)
+            wts = wts[last[inverse[keep]]]
+            src, dst = src[keep], dst[keep]
+
+        order = np.argsort(src, kind="stable")
+        self._indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self._indptr[1:])
+        self._indices = dst[order].astype(np.int32)
+        self._weights = wts[order]
+
+    @property
+    def indptr(self):
+        self.rebuild()
+        return self._indptr
+
+    @property
+    def indices(self):
+        self.rebuild()
+        return self._indices
+
+    @property
+    def weights(self):
+        self.rebuild()
+        return self._weights
+
+    @property
+    def degree(self):
+        return np.diff(self.indptr)
+
+    @property
+    def nedges(self):
+        """Number of directed edges (twice the number of links)."""
+        return len(self.indices)
+
+    def neighbors_of(self, i):
+        """Indices and weights of community i's neighbors (views)."""
+        self.rebuild()
+        start, stop = self._indptr[i], self._indptr[i + 1]
+        return self._indices[start:stop], self._weights[start:stop]
+
+    def two_hop(self):
+        """
+        CSR (indptr, indices) of every community's second-degree neighbors
+        in index order, computed once and kept until edges are added.
+        """
+        self.rebuild()
+        if self._two_hop is None:
+            from scipy import sparse
+            from vecsim import two_hop
+
+            n = len(self)
+            adjacency = sparse.csr_matrix(
+                (self.weights, self.indices, self.indptr), shape=(n, n))
+            reach = two_hop(adjacency)
+            self._two_hop = (reach.indptr, reach.indices)
+        return self._two_hop
+
+    @property
+    def nbytes(self):
+        arrays = (self.x, self.y, self.type_code, self.size, self.val,
+                  self.rate, self.indptr, self.indices, self.weights)
+        return sum(a.nbytes for a in arrays)
+
+    @classmethod
+    def from_arrays(cls, x, y, types, indptr, indices, weights):
+        """Build a World from coordinates, types and CSR adjacency."""
+        self = cls(x, y, types)
+        self._indptr = np.array(indptr, dtype=np.int64)
+        self._indices = np.array(indices, dtype=np.int32)
+        self._weights = np.array(weights, dtype=float)
+        return self
+
+    @classmethod
+    def from_communities(cls, world):
+        """Build a World from a list of Community objects."""
+        from checkpoint import world_to_arrays
+
+        arrays = world_to_arrays(world)
+        self = cls.from_arrays(arrays['x'], arrays['y'],
+                               arrays['type'].tolist(), arrays['indptr'],
+                               arrays['indices'], arrays['weights'])
+        self.val[:] = [comm.val for comm in world]
+        self.rate[:] = [comm.rate_of_change for comm in world]
+        self.hists = [list(comm.hist) if len(comm.hist) else None
+                      for comm in world]
+        return self
+
+    def to_communities(self, commclass=Community):
+        """Build a list of `commclass` objects from the World."""
+        world = [commclass(x, y, commtype) for x, y, commtype in
+                 zip(self.x.tolist(), self.y.tolist(), self.types)]
+        for comm, val, rate, view in zip(world, self.val.tolist(),
+                                         self.rate.tolist(), self):
+            comm.val = val
+            comm.rate_of_change = rate
+            comm.hist = list(view.hist)
+        indptr, indices = self.indptr, self.indices.tolist()
+        weights = self.weights.tolist()
+        for i, comm in enumerate(world):
+            for k in range(indptr[i], indptr[i + 1]):
+                comm.neighbors[world[indices[k]]] = weights[k]
+        return world
@@ -0,0 +1,104 @@
+"""
+Content-addressed on-disk cache of generated worlds.
+
+Worlds are keyed by the gen_world parameters together with a hash of
+DIST_THRESHOLDS and COMM_SIZES, and stored in the same compact array format
+as checkpoints. The cache directory is kept under a byte budget by evicting
+the least recently used entries.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from checkpoint import (world_to_arrays, world_from_arrays,
+                        random_state_to_arrays, random_state_from_arrays)
+from community import COMM_SIZES, DIST_THRESHOLDS
+
+logger = logging.getLogger(__name__)
+
+
+class WorldCache:
+    def __init__(self, cachedir="worldcache", max_bytes=256 * 2 ** 20):
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        os.makedirs(cachedir, exist_ok=True)
+
+    def key(self, size, density, seed, commclass):
+        params = {
+            'size': size,
+            'density': density,
+            'seed': seed,
+            'commclass': f"{commclass.__module__}:{commclass.__qualname__}",
+            'dist_thresholds': sorted(
+                [list(k), v] for k, v in DIST_THRESHOLDS.items()),
+            'comm_sizes': sorted(COMM_SIZES.items()),
+        }
+        blob = json.dumps(params, sort_keys=True).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cachedir, f"{key}.npz")
+
+    def load(self, key, commclass):
+        """
+        Return the cached world for `key`, or None. On a hit the `random`
+        module is left in the state gen_world would have left it in.
+        """
+        path = self.path(key)
+        try:
+            with np.load(path) as arrays:
+                world = world_from_arrays(arrays, commclass=commclass)
+                random_state_from_arrays(arrays)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        logger.info(f"Loaded world from cache '{path}'.")
+        return world
+
+    def store(self, key, world):
+        arrays = world_to_arrays(world)
+        arrays.update(random_state_to_arrays())
+        path = self.path(key)
+        # written under a temporary name, so that other processes sharing
+        # the cache never load a partly written world
+        tmppath = f"{path}.{os.getpid()}.tmp"
+        with open(tmppath, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmppath, path)
+        logger.info(f"Stored world in cache '{path}'.")
+        self.evict()
+
+    def entries(self):
+        """Cache files as (last use, bytes, path), least recent first."""
+        entries = []
+        for name in os.listdir(self.cachedir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cachedir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    # evicted by another process sharing the cache
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.info(f"Evicted '{path}' from world cache.")
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)